@@ -0,0 +1,10 @@
+'''
+Benchmarks de las partes críticas del proyecto (procesamiento de tweets, parseo de documentos
+de elasticsearch, resolución de urls y reparto de peticiones entre las claves de la API de
+twitter). No necesitan claves de la API de twitter ni un servidor de elasticsearch: los datos
+se obtienen de ficheros grabados previamente (ver benchmarks.fixtures) y se sirven mediante
+servidores locales falsos (ver benchmarks.fakes)
+
+Se ejecutan desde el directorio raíz del proyecto:
+python -m benchmarks.run
+'''
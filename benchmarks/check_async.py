@@ -0,0 +1,77 @@
+'''
+Comprueba el tratamiento de errores de AsyncElasticSearchCollector contra un elasticsearch
+falso (ver fakes.FakeElasticsearch):
+- Los errores temporales (503) se reintentan hasta obtener la respuesta.
+- Los errores no recuperables (400) no se reintentan.
+- Si ningún host responde, la consulta falla al superarse el tiempo máximo de reintentos.
+e.g:
+python -m benchmarks.check_async
+'''
+
+import asyncio
+import socket
+from time import time
+
+from elasticsearch_dsl.query import Match
+
+from benchmarks.fakes import FakeElasticsearch
+from benchmarks.fixtures import make_es_hits
+from model.elasticsearch_async import AsyncElasticSearchCollector, ElasticSearchError
+
+
+query = Match(**{'body.es': '@sanchezcastejon'})
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def check_transient_error(hits):
+    with FakeElasticsearch(hits, error_status = 503, num_errors = 2) as es:
+        async with AsyncElasticSearchCollector(['http://127.0.0.1:{}'.format(es.port)], initial_backoff = 0.01,
+                                               max_retry_time = 5) as collector:
+            tweets = await collector.search_tweets(query, 0, 10)
+            results = await collector.search_tweets_many([query, query], 0, 5)
+        assert len(tweets) == 10, len(tweets)
+        assert [len(tweets) for tweets in results] == [5, 5], results
+        assert es.num_requests == 4, es.num_requests
+    return '503: reintentada 2 veces'
+
+
+async def check_permanent_error(hits):
+    with FakeElasticsearch(hits, error_status = 400, num_errors = 1) as es:
+        async with AsyncElasticSearchCollector(['http://127.0.0.1:{}'.format(es.port)], initial_backoff = 0.01,
+                                               max_retry_time = 5) as collector:
+            try:
+                await collector.search_tweets(query)
+                raise AssertionError('Se esperaba ElasticSearchError')
+            except ElasticSearchError as e:
+                assert e.status == 400, e.status
+        assert es.num_requests == 1, es.num_requests
+    return '400: sin reintentos'
+
+
+async def check_deadline():
+    start_time = time()
+    async with AsyncElasticSearchCollector(['http://127.0.0.1:{}'.format(_get_free_port())], initial_backoff = 0.05,
+                                           max_retry_time = 0.5) as collector:
+        try:
+            await collector.search_tweets(query)
+            raise AssertionError('Se esperaba un error de conexión')
+        except (OSError, asyncio.TimeoutError):
+            pass
+    elapsed_time = time() - start_time
+    assert elapsed_time <= 1.0, elapsed_time
+    return 'Host inaccesible: falla tras {:.2f}s'.format(elapsed_time)
+
+
+async def main():
+    hits = make_es_hits(20)
+    for check in (check_transient_error(hits), check_permanent_error(hits), check_deadline()):
+        print(await check)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
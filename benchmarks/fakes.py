@@ -0,0 +1,235 @@
+'''
+Este script define servidores y APIs falsas que se usan en los benchmarks en lugar de
+elasticsearch, de los servidores de los acortadores de urls y de la API de twitter.
+'''
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Lock, Thread
+from time import sleep, time
+
+import tweepy
+from tweepy.models import Status
+
+
+class _LocalServer:
+    '''
+    Servidor HTTP local que se ejecuta en segundo plano (en un puerto libre)
+    '''
+    def __init__(self, handler_class):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.server.daemon_threads = True
+        self.server.owner = self
+        self.port = self.server.server_address[1]
+        self.thread = Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Conexiones keep-alive. Las cabeceras y el cuerpo de las respuestas se escriben por
+    # separado: sin TCP_NODELAY, cada respuesta se retrasaría hasta 40ms (delayed ACK)
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body = b'', headers = ()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class FakeElasticsearch(_LocalServer):
+    '''
+    Servidor de elasticsearch falso. Responde a las búsquedas (_search y _msearch) con los
+    documentos indicados, paginados según los parámetros "from" y "size" de cada búsqueda (la
+    query se ignora). Las peticiones _bulk se aceptan (los documentos indexados se cuentan,
+    pero no se guardan)
+    '''
+    def __init__(self, hits = (), latency = 0, reject_ratio = 0, seed = 0, error_status = 503, num_errors = 0):
+        '''
+        :param hits: Lista de documentos (ver fixtures.make_es_hits)
+        :param latency: Tiempo (en segundos) que tarda en responderse cada petición.
+        :param reject_ratio: Fracción de los documentos de cada petición _bulk que se rechazan
+        temporalmente (código 429, como cuando la cola de indexación está llena)
+        :param error_status: Código de respuesta HTTP de las peticiones que fallan (ver num_errors)
+        :param num_errors: Número de peticiones (las primeras) a las que se responde con el
+        error error_status, en lugar de con los documentos.
+        '''
+        self.hits = list(hits)
+        self.latency = latency
+        self.reject_ratio = reject_ratio
+        self.random = Random(seed)
+        self.error_status = error_status
+        self.num_errors = num_errors
+        self.lock = Lock()
+        self.num_requests = 0
+        self.num_indexed = 0
+        self.num_rejected = 0
+        super().__init__(_ElasticsearchHandler)
+
+    def bulk(self, body):
+        lines = [line for line in body.splitlines() if line.strip()]
+        items = []
+        with self.lock:
+            for action in lines[::2]:
+                op, meta = next(iter(json.loads(action).items()))
+                if self.random.random() < self.reject_ratio:
+                    self.num_rejected += 1
+                    items.append({op: {'_id': meta.get('_id'), 'status': 429,
+                                       'error': {'type': 'es_rejected_execution_exception'}}})
+                else:
+                    self.num_indexed += 1
+                    items.append({op: {'_id': meta.get('_id'), 'status': 201, 'result': 'created'}})
+        return {'took': 1, 'errors': any(['error' in next(iter(item.values())) for item in items]), 'items': items}
+
+    def get_page(self, query):
+        start = query.get('from', 0)
+        hits = self.hits[start:start+query.get('size', 10)]
+        return {'took': 1, 'timed_out': False, '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+                'hits': {'total': len(self.hits), 'max_score': 1.0, 'hits': hits}}
+
+
+class _ElasticsearchHandler(_Handler):
+    def do_HEAD(self):
+        self.send(200, headers = [('Content-Type', 'application/json')])
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        es = self.server.owner
+        with es.lock:
+            es.num_requests += 1
+            failed = es.num_requests <= es.num_errors
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        if es.latency > 0:
+            sleep(es.latency)
+        if failed:
+            error = {'error': {'type': 'fake_error', 'reason': 'Error simulado'}, 'status': es.error_status}
+            self.send(es.error_status, json.dumps(error).encode('utf-8'), [('Content-Type', 'application/json')])
+            return
+        if '_bulk' in self.path:
+            data = es.bulk(body)
+        elif '_msearch' in self.path:
+            queries = [json.loads(line) for line in body.splitlines() if line.strip()][1::2]
+            data = {'responses': [es.get_page(query) for query in queries]}
+        else:
+            data = es.get_page(json.loads(body) if body else {})
+        self.send(200, json.dumps(data).encode('utf-8'), [('Content-Type', 'application/json')])
+
+
+class RedirectServer(_LocalServer):
+    '''
+    Servidor que simula un acortador de urls. La url /r/<n>/<id> redirige a /r/<n-1>/<id>, y
+    así sucesivamente hasta llegar a /a/<id> (la dirección final)
+    '''
+    def __init__(self, latency = 0):
+        '''
+        :param latency: Tiempo (en segundos) que tarda en responderse cada petición.
+        '''
+        self.latency = latency
+        self.num_requests = 0
+        self.lock = Lock()
+        super().__init__(_RedirectHandler)
+
+    def get_link(self, id, num_redirects = 1):
+        '''
+        :return: Devuelve una url que redirige num_redirects veces antes de llegar a su dirección
+        final.
+        '''
+        return 'http://127.0.0.1:{}/r/{}/{}'.format(self.port, num_redirects, id)
+
+
+class _RedirectHandler(_Handler):
+    def do_HEAD(self):
+        server = self.server.owner
+        with server.lock:
+            server.num_requests += 1
+        if server.latency > 0:
+            sleep(server.latency)
+        parts = self.path.split('/')
+        if len(parts) == 4 and parts[1] == 'r':
+            num_redirects = int(parts[2]) - 1
+            location = '/r/{}/{}'.format(num_redirects, parts[3]) if num_redirects > 0 else '/a/' + parts[3]
+            self.send(301, headers = [('Location', location)])
+        else:
+            self.send(200, b'ok', [('Content-Type', 'text/plain')])
+
+    def do_GET(self):
+        self.do_HEAD()
+
+
+class _FakeResponse:
+    def __init__(self, remaining, reset):
+        self.headers = {'x-rate-limit-remaining': str(remaining), 'x-rate-limit-reset': str(reset)}
+
+
+class FakeTwitterAPI:
+    '''
+    Sustituye a la clase tweepy.API. Simula los rate limits de la API de twitter: cada clave
+    puede realizar un número limitado de peticiones en cada ventana de tiempo. Las respuestas
+    incluyen las cabeceras x-rate-limit-remaining y x-rate-limit-reset, y si se supera el límite
+    se genera la excepción tweepy.RateLimitError
+    '''
+    def __init__(self, statuses, requests_per_window = 15, window = 1, latency = 0):
+        '''
+        :param statuses: Lista de payloads de tweets (ver fixtures.make_status_payloads)
+        :param requests_per_window: Número de peticiones por ventana de tiempo.
+        :param window: Duración (en segundos) de la ventana de tiempo.
+        :param latency: Tiempo (en segundos) que tarda en responderse cada petición.
+        '''
+        self.statuses = {status['id_str']: status for status in statuses}
+        self.requests_per_window = requests_per_window
+        self.window = window
+        self.latency = latency
+        self.lock = Lock()
+        self.window_end = 0
+        self.remaining = 0
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.last_response = None
+
+    def _request(self):
+        with self.lock:
+            now = time()
+            if now >= self.window_end:
+                self.window_end = now + self.window
+                self.remaining = self.requests_per_window
+            # Las cabeceras de twitter indican el reset en segundos enteros.
+            response = _FakeResponse(max(self.remaining - 1, 0), int(self.window_end + 0.999))
+            if self.remaining == 0:
+                self.num_rate_limited += 1
+                raise tweepy.RateLimitError('Rate limit exceeded', response)
+            self.remaining -= 1
+            self.num_requests += 1
+        if self.latency > 0:
+            sleep(self.latency)
+        self.last_response = response
+
+    def get_status(self, id):
+        self._request()
+        status = self.statuses.get(str(id))
+        if status is None:
+            raise tweepy.TweepError('No status found with that ID.', api_code = 144)
+        return Status.parse(None, status)
+
+    def statuses_lookup(self, ids):
+        self._request()
+        return [Status.parse(None, self.statuses[str(id)]) for id in ids if str(id) in self.statuses]
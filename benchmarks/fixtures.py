@@ -0,0 +1,159 @@
+'''
+Este script proporciona los datos usados por los benchmarks: respuestas de la API de twitter
+(payloads JSON de tweets, tal y como los devuelve tweepy en Status._json) y páginas de
+documentos de elasticsearch (hits).
+Los datos se leen de los ficheros del directorio benchmarks/fixtures si existen (pueden
+grabarse con las funciones record_statuses y record_es_hits). En caso contrario, se generan
+datos sintéticos con la misma estructura (siempre los mismos, para que los resultados sean
+comparables entre ejecuciones)
+'''
+
+import json
+from datetime import datetime, timedelta
+from os import makedirs
+from os.path import dirname, exists, join
+from random import Random
+
+
+fixtures_dir = join(dirname(__file__), 'fixtures')
+
+_words = ['el', 'gobierno', 'presidente', 'elecciones', '#debate', '@usuario', 'hoy', 'RT', 'vía', 'que',
+          'congreso', 'votación', 'España', 'política', '#9J', 'mañana', 'ñandú', 'partido']
+_start_date = datetime(2018, 5, 12, 10, 0)
+
+
+def _random_text(random, links):
+    words = [random.choice(_words) for i in range(random.randint(5, 20))]
+    return ' '.join(words + links)
+
+
+def make_status_payloads(num_statuses = 1000, seed = 0, link_base = 'https://t.co/'):
+    '''
+    Genera payloads de tweets sintéticos (con el formato de la API de twitter v1.1)
+    :param num_statuses: Número de tweets a generar.
+    :param link_base: Prefijo de las urls que aparecen en los tweets (la mitad de los tweets
+    contienen urls)
+    :return: Devuelve una lista de diccionarios.
+    '''
+    random = Random(seed)
+    users = [{'id': 1000 + i, 'id_str': str(1000 + i), 'screen_name': 'usuario{}'.format(i),
+              'followers_count': random.randint(0, 100000), 'friends_count': random.randint(0, 5000)}
+             for i in range(0, max(num_statuses // 10, 1))]
+    statuses = []
+    for i in range(0, num_statuses):
+        id = 995000000000000000 + i
+        date = _start_date + timedelta(seconds = i * 7)
+        links = [link_base + str(random.randint(0, 10 ** 6)) for j in range(random.choice((0, 0, 1, 2)))]
+        status = {
+            'id': id,
+            'id_str': str(id),
+            'text': _random_text(random, links),
+            'created_at': date.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+            'retweet_count': random.randint(0, 500),
+            'in_reply_to_status_id': None,
+            'user': random.choice(users)
+        }
+        kind = random.random()
+        if kind < 0.3 and len(statuses) > 0:
+            retweeted = random.choice(statuses)
+            status['retweeted_status'] = dict(retweeted)
+        elif kind < 0.45 and len(statuses) > 0:
+            status['in_reply_to_status_id'] = random.choice(statuses)['id']
+        statuses.append(status)
+    return statuses
+
+
+def make_es_hits(num_docs = 1000, seed = 0):
+    '''
+    Genera documentos de elasticsearch sintéticos (índice "shokesu", tipo "posts")
+    :return: Devuelve una lista de hits (diccionarios con las claves _index, _type, _id y _source)
+    '''
+    hits = []
+    for status in make_status_payloads(num_docs, seed):
+        user = status['user']
+        is_retweet = 'retweeted_status' in status
+        is_reply = not status['in_reply_to_status_id'] is None
+        created_at = datetime.strptime(status['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
+        source = {
+            'provider': 'twitter',
+            'post_id': status['id_str'],
+            'body': {'es': status['text']},
+            'is_retweet': is_retweet,
+            'is_reply': is_reply,
+            'retweet_count': status['retweet_count'],
+            'retweet_id': status['retweeted_status']['id_str'] if is_retweet else
+                          (str(status['in_reply_to_status_id']) if is_reply else None),
+            'published_at': created_at.strftime('%Y-%m-%dT%H:%M') + '+02:00',
+            'user': {'screenname': user['screen_name'], 'followers_count': user['followers_count'],
+                     'friends_count': user['friends_count']}
+        }
+        hits.append({'_index': 'shokesu', '_type': 'posts', '_id': status['id_str'], '_source': source})
+    return hits
+
+
+def load_fixture(name, factory, *args, **kwargs):
+    '''
+    Carga un fichero de datos grabado previamente (benchmarks/fixtures/<name>.json). Si no existe,
+    los datos se generan con la función indicada.
+    :param factory: Función que genera los datos (e.g: make_status_payloads). Recibe el resto
+    de parámetros.
+    :return: Devuelve los datos (una lista)
+    '''
+    path = join(fixtures_dir, name + '.json')
+    if exists(path):
+        with open(path, 'r') as file:
+            return json.load(file)
+    return factory(*args, **kwargs)
+
+
+def save_fixture(name, data):
+    '''
+    Guarda los datos indicados en el fichero benchmarks/fixtures/<name>.json
+    '''
+    makedirs(fixtures_dir, exist_ok = True)
+    with open(join(fixtures_dir, name + '.json'), 'w') as file:
+        json.dump(data, file)
+
+
+def record_statuses(terms, count = 1000, name = 'statuses'):
+    '''
+    Graba los payloads de los tweets que devuelve la API de twitter (endpoint search/tweets) para
+    los términos indicados. Requiere claves de la API de twitter.
+    :return: Devuelve el número de tweets grabados.
+    '''
+    from model.twitter_api_pool import TwitterAPIPool
+    pool = TwitterAPIPool()
+    statuses = []
+    params = {}
+    while len(statuses) < count:
+        page = pool.execute('search', q = terms, count = 100, **params)
+        if len(page) == 0:
+            break
+        statuses.extend(status._json for status in page)
+        params['max_id'] = min([status.id for status in page]) - 1
+    save_fixture(name, statuses[:count])
+    return len(statuses[:count])
+
+
+def record_es_hits(query, count = 1000, name = 'es_hits'):
+    '''
+    Graba los documentos de elasticsearch que encajan con la query indicada. Requiere un servidor
+    de elasticsearch.
+    :return: Devuelve el número de documentos grabados.
+    '''
+    from elasticsearch_dsl.query import Term
+    from model.elasticsearch_utils import ElasticSearchCollector
+    from model.elasticsearch_parser import TWEET_SOURCE_FIELDS
+    hits = ElasticSearchCollector()._search(query & Term(provider = 'twitter'), num_docs = count,
+                                            fields = TWEET_SOURCE_FIELDS)
+    save_fixture(name, hits)
+    return len(hits)
+
+
+if __name__ == '__main__':
+    # e.g: python -m benchmarks.fixtures "@sanchezcastejon"
+    import sys
+    from elasticsearch_dsl.query import Match
+    terms = sys.argv[1]
+    print('{} tweets grabados'.format(record_statuses(terms)))
+    print('{} documentos grabados'.format(record_es_hits(Match(**{'body.es': terms}))))
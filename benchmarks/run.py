@@ -0,0 +1,193 @@
+'''
+Ejecuta los benchmarks y muestra sus resultados (throughput, percentiles de latencia y pico
+de memoria).
+e.g:
+python -m benchmarks.run                                   # Todos los benchmarks
+python -m benchmarks.run process_tweet es_parse            # Solo los indicados
+python -m benchmarks.run --save baseline.json              # Guarda los resultados
+python -m benchmarks.run --baseline baseline.json          # Falla si hay regresiones
+'''
+
+import argparse
+import json
+import subprocess
+import sys
+from os.path import dirname, join
+from tempfile import mkdtemp
+
+from tweepy.models import Status
+from elasticsearch_dsl.query import Match
+
+from benchmarks.fakes import FakeElasticsearch, RedirectServer, FakeTwitterAPI
+from benchmarks.fixtures import load_fixture, make_status_payloads, make_es_hits
+from benchmarks.utils import run_benchmark, format_results, save_results, load_results, find_regressions
+
+from model.twitter_api_pool import TwitterAPIPool
+from model.twitter_utils import Twitter
+from model.elasticsearch_parser import TweetDocumentParser
+from model.elasticsearch_utils import ElasticSearchCollector
+from model.elasticsearch_bulk import BulkWriter
+from model.url_utils import LinkResolver
+from model.tweet import Tweet
+
+
+def _use_fake_keys(num_keys):
+    '''
+    Crea un fichero de claves falsas de la API de twitter (las APIs se sustituyen después por
+    instancias de FakeTwitterAPI, de modo que nunca se usan)
+    '''
+    path = join(mkdtemp(), 'tweet_keys.json')
+    with open(path, 'w') as file:
+        for i in range(0, num_keys):
+            file.write(json.dumps({'consumer_key': 'key{}'.format(i), 'consumer_secret': 'secret',
+                                   'access_token': 'token', 'access_token_secret': 'secret'}) + '\n')
+    TwitterAPIPool.twitter_api_keys_file = path
+
+
+def _batches(items, batch_size):
+    return [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+
+
+def benchmark_process_tweet(size):
+    '''
+    Conversión de los tweets devueltos por la API (tweepy.Status) en instancias de Tweet
+    '''
+    statuses = [Status.parse(None, payload) for payload in load_fixture('statuses', make_status_payloads, size)]
+    twitter = Twitter()
+    return run_benchmark('process_tweet', lambda batch: len([twitter._process_tweet(status) for status in batch]),
+                         _batches(statuses, 100), repeat = 5)
+
+
+def benchmark_es_parse(size):
+    '''
+    Conversión de los documentos de elasticsearch en instancias de Tweet
+    '''
+    hits = load_fixture('es_hits', make_es_hits, size)
+    parser = TweetDocumentParser()
+    return run_benchmark('es_parse', lambda batch: len(parser.parse_batch(batch)[0]), _batches(hits, 500), repeat = 5)
+
+
+def benchmark_search_tweets(size):
+    '''
+    Consultas de tweets a elasticsearch (petición HTTP, deserialización y parseo)
+    '''
+    hits = load_fixture('es_hits', make_es_hits, size)
+    with FakeElasticsearch(hits) as es:
+        collector = ElasticSearchCollector(hosts = [{'host': '127.0.0.1', 'port': es.port}])
+        query = Match(**{'body.es': '@sanchezcastejon'})
+        return run_benchmark('search_tweets', lambda first: len(collector.search_tweets(query, first, 500)),
+                             list(range(0, len(hits), 500)), repeat = 3)
+
+
+def benchmark_bulk_index(size):
+    '''
+    Indexación de tweets con BulkWriter (lotes de 250 tweets, 4 lotes a la vez), contra un
+    elasticsearch falso que tarda 10ms en responder cada petición y rechaza temporalmente el 5%
+    de los documentos.
+    '''
+    hits = load_fixture('es_hits', make_es_hits, size)
+    tweets = TweetDocumentParser().parse_batch(hits)[0]
+    with FakeElasticsearch(latency = 0.01, reject_ratio = 0.05) as es:
+        collector = ElasticSearchCollector(hosts = [{'host': '127.0.0.1', 'port': es.port}])
+        writer = BulkWriter(client = collector.client, max_batch_docs = 250, max_in_flight = 4,
+                            initial_backoff = 0.01, flush_interval = None)
+
+        def index_batch(batch):
+            writer.add_many(batch)
+            writer.flush()
+            return len(batch)
+
+        try:
+            return run_benchmark('bulk_index', index_batch, _batches(tweets, 1000), repeat = 3)
+        finally:
+            writer.close()
+
+
+def benchmark_info_sources(size):
+    '''
+    Obtención de las fuentes de información de los tweets (siguiendo las redirecciones de sus
+    urls, contra un servidor local)
+    '''
+    with RedirectServer(latency = 0.001) as server:
+        link_base = server.get_link('', num_redirects = 2)
+        statuses = make_status_payloads(size // 5, link_base = link_base)
+        twitter = Twitter()
+        tweets = [twitter._process_tweet(Status.parse(None, payload)) for payload in statuses]
+        # La caché se desactiva para medir el coste de resolver las urls.
+        resolver = LinkResolver(max_workers = 16, cache = None)
+        return run_benchmark('info_sources', lambda batch: len(Tweet.get_info_sources_batch(batch, resolver = resolver)),
+                             _batches(tweets, 50))
+
+
+def benchmark_pool_scheduling(size):
+    '''
+    Reparto de peticiones concurrentes entre las claves de la API de twitter, con rate limits
+    simulados (cada clave admite 20 peticiones por segundo)
+    '''
+    statuses = load_fixture('statuses', make_status_payloads, size)
+    pool = TwitterAPIPool()
+    pool.apis = [FakeTwitterAPI(statuses, requests_per_window = 20, window = 1, latency = 0.002)
+                 for api in pool.apis]
+    ids = [status['id_str'] for status in statuses[:max(size // 25, 40)]]
+
+    def request_batch(batch):
+        futures = [pool.submit('get_status', id) for id in batch]
+        return len([future.result() for future in futures])
+
+    return run_benchmark('pool_scheduling', request_batch, _batches(ids, 40), trace_memory = False)
+
+
+def benchmark_startup(size):
+    '''
+    Tiempo de arranque de un proceso que importa los módulos de tweets y usuarios y crea el
+    singleton Twitter (como los scripts que solo realizan una consulta). Incluye el arranque del
+    intérprete de python.
+    '''
+    code = 'import model.tweet, model.user; from model.twitter_utils import Twitter; Twitter()'
+    root_dir = dirname(dirname(__file__)) or '.'
+    return run_benchmark('startup', lambda i: subprocess.run([sys.executable, '-c', code], cwd = root_dir, check = True) and 1,
+                         list(range(0, 10)), trace_memory = False)
+
+
+benchmarks = {
+    'process_tweet': benchmark_process_tweet,
+    'es_parse': benchmark_es_parse,
+    'search_tweets': benchmark_search_tweets,
+    'bulk_index': benchmark_bulk_index,
+    'info_sources': benchmark_info_sources,
+    'pool_scheduling': benchmark_pool_scheduling,
+    'startup': benchmark_startup
+}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Ejecuta los benchmarks')
+    parser.add_argument('names', nargs = '*', help = 'Benchmarks a ejecutar: {} (por defecto, todos)'.format(', '.join(benchmarks)))
+    parser.add_argument('--size', type = int, default = 5000, help = 'Número de tweets/documentos de los datos sintéticos')
+    parser.add_argument('--save', help = 'Guarda los resultados en el fichero JSON indicado')
+    parser.add_argument('--baseline', help = 'Compara los resultados con los del fichero JSON indicado')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'Empeoramiento máximo admitido respecto a la referencia')
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if not name in benchmarks:
+            parser.error('Benchmark desconocido: {}'.format(name))
+
+    _use_fake_keys(4)
+    results = []
+    for name in (args.names or list(benchmarks)):
+        results.append(benchmarks[name](args.size))
+    print(format_results(results))
+
+    if not args.save is None:
+        save_results(results, args.save)
+    if not args.baseline is None:
+        regressions = find_regressions(results, load_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print('Regresión: ' + regression)
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
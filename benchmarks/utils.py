@@ -0,0 +1,126 @@
+'''
+Utilidades para medir y comparar los resultados de los benchmarks.
+'''
+
+import json
+import tracemalloc
+from collections import namedtuple
+from time import perf_counter
+
+
+# Resultado de un benchmark. Las latencias (percentiles 50, 90 y 99 y máxima) son las de cada
+# operación, en segundos. El pico de memoria está en bytes.
+BenchmarkResult = namedtuple('BenchmarkResult', ['name', 'num_items', 'elapsed_time', 'throughput',
+                                                 'p50', 'p90', 'p99', 'max_latency', 'peak_memory'])
+
+
+def percentile(sorted_values, p):
+    '''
+    :param sorted_values: Lista de valores ordenados de menor a mayor.
+    :param p: Percentil (entre 0 y 100)
+    :return: Devuelve el percentil indicado (método nearest-rank)
+    '''
+    if len(sorted_values) == 0:
+        return 0.0
+    index = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def run_benchmark(name, operation, inputs, trace_memory = True, repeat = 1):
+    '''
+    Ejecuta un benchmark.
+    :param operation: Es la operación a medir. Recibe cada una de las entradas, y devuelve el
+    número de elementos procesados (tweets, documentos, ...)
+    :param inputs: Lista de entradas. La operación se invoca una vez por cada entrada.
+    :param trace_memory: Si es True, las operaciones se ejecutan una segunda vez (con
+    tracemalloc activado) para medir el pico de memoria. Los tiempos no se miden en esta
+    pasada (tracemalloc ralentiza la ejecución)
+    :param repeat: Número de veces que se procesan todas las entradas. El throughput se calcula
+    con la más rápida de ellas (reduce el ruido en los benchmarks cortos), y los percentiles con
+    las latencias de todas.
+    :return: Devuelve una instancia de BenchmarkResult
+    '''
+    latencies = []
+    elapsed_time = None
+    for i in range(0, repeat):
+        num_items = 0
+        start_time = perf_counter()
+        for input in inputs:
+            operation_start_time = perf_counter()
+            num_items += operation(input)
+            latencies.append(perf_counter() - operation_start_time)
+        round_time = perf_counter() - start_time
+        elapsed_time = round_time if elapsed_time is None else min(elapsed_time, round_time)
+
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            for input in inputs:
+                operation(input)
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    latencies.sort()
+    return BenchmarkResult(name, num_items, elapsed_time, num_items / elapsed_time if elapsed_time > 0 else 0.0,
+                           percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+                           latencies[-1] if len(latencies) > 0 else 0.0, peak_memory)
+
+
+def format_results(results):
+    '''
+    :return: Devuelve una tabla (un string) con los resultados indicados.
+    '''
+    lines = ['{:<18} {:>8} {:>9} {:>12} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+        'benchmark', 'items', 'time(s)', 'items/s', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)', 'peak(KiB)')]
+    for result in results:
+        lines.append('{:<18} {:>8} {:>9.3f} {:>12.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>10}'.format(
+            result.name, result.num_items, result.elapsed_time, result.throughput,
+            result.p50 * 1000, result.p90 * 1000, result.p99 * 1000, result.max_latency * 1000,
+            '{:.0f}'.format(result.peak_memory / 1024) if not result.peak_memory is None else '-'))
+    return '\n'.join(lines)
+
+
+def save_results(results, path):
+    '''
+    Guarda los resultados en un fichero JSON (puede usarse después como referencia, ver
+    find_regressions)
+    '''
+    with open(path, 'w') as file:
+        json.dump({result.name: result._asdict() for result in results}, file, indent = 2)
+
+
+def load_results(path):
+    '''
+    :return: Devuelve un diccionario nombre -> BenchmarkResult con los resultados guardados en el
+    fichero indicado.
+    '''
+    with open(path, 'r') as file:
+        return {name: BenchmarkResult(**result) for name, result in json.load(file).items()}
+
+
+def find_regressions(results, baseline, tolerance = 0.2):
+    '''
+    Compara los resultados de los benchmarks con los de referencia.
+    :param baseline: Diccionario nombre -> BenchmarkResult con los resultados de referencia.
+    :param tolerance: Fracción máxima en la que puede empeorar el throughput, o aumentar la
+    latencia p90 o el pico de memoria, respecto a la referencia.
+    :return: Devuelve una lista de strings describiendo cada regresión encontrada.
+    '''
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.name)
+        if reference is None:
+            continue
+        if result.throughput < reference.throughput * (1 - tolerance):
+            regressions.append('{}: throughput {:.1f} items/s (referencia: {:.1f})'.format(
+                result.name, result.throughput, reference.throughput))
+        if result.p90 > reference.p90 * (1 + tolerance):
+            regressions.append('{}: latencia p90 {:.3f}ms (referencia: {:.3f}ms)'.format(
+                result.name, result.p90 * 1000, reference.p90 * 1000))
+        if not result.peak_memory is None and not reference.peak_memory is None and \
+                result.peak_memory > reference.peak_memory * (1 + tolerance):
+            regressions.append('{}: pico de memoria {:.0f}KiB (referencia: {:.0f}KiB)'.format(
+                result.name, result.peak_memory / 1024, reference.peak_memory / 1024))
+    return regressions
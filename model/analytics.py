@@ -0,0 +1,145 @@
+'''
+Este script contiene funciones para analizar colecciones de tweets (instancias de la clase
+TweetBatch). Todas las operaciones se realizan sobre las columnas de la colección con numpy, sin
+recorrer los tweets uno a uno.
+'''
+
+import numpy
+
+from model.tweet_batch import TweetBatch
+
+
+def group_sum(keys, values = None):
+    '''
+    Agrupa valores por clave y los suma.
+    :param keys: Es un array de numpy con la clave de cada elemento.
+    :param values: Es un array de numpy con el valor de cada elemento. Si no se especifica, se
+    cuenta el número de elementos de cada grupo.
+    :return: Devuelve una tupla (claves, sumas), donde claves es un array ordenado con las claves
+    distintas y sumas es un array con la suma de los valores de cada clave.
+    '''
+    unique_keys, inverse = numpy.unique(keys, return_inverse = True)
+    sums = numpy.bincount(inverse, weights = values, minlength = len(unique_keys))
+    if values is None:
+        sums = sums.astype(numpy.int64)
+    return unique_keys, sums
+
+
+def count_by_author(batch):
+    '''
+    :return: Devuelve un array con el número de tweets de cada autor (indexado por el índice del
+    autor en la colección)
+    '''
+    return numpy.bincount(batch.get_column('author_indices'), minlength = batch.get_num_authors())
+
+
+def top_authors(batch, n = 10):
+    '''
+    :return: Devuelve una lista de tuplas (nombre del autor, número de tweets) con los n autores
+    con más tweets en la colección.
+    '''
+    counts = count_by_author(batch)
+    indices = numpy.argsort(counts)[::-1][:n]
+    return [(batch.author_names[index], int(counts[index])) for index in indices]
+
+
+def post_type_ratios(batch):
+    '''
+    :return: Devuelve un diccionario con la proporción de tweets de cada tipo ('original',
+    'retweet' y 'reply')
+    '''
+    counts = numpy.bincount(batch.get_column('post_type_codes'), minlength = len(TweetBatch.post_types))
+    total = max(len(batch), 1)
+    return {post_type: float(counts[code]) / total for code, post_type in enumerate(TweetBatch.post_types)}
+
+
+def retweet_histogram(batch, bins = 10, log_scale = False):
+    '''
+    Calcula un histograma del número de retweets de los tweets de la colección.
+    :param bins: Número de intervalos del histograma.
+    :param log_scale: Si es True, los intervalos se distribuyen en escala logarítmica (útil
+    porque la distribución de retweets es muy asimétrica)
+    :return: Devuelve una tupla (frecuencias, límites de los intervalos)
+    '''
+    num_retweets = batch.get_column('num_retweets')
+    if log_scale:
+        edges = numpy.geomspace(1, num_retweets.max(initial = 1) + 1, bins + 1) - 1
+        return numpy.histogram(num_retweets, bins = edges)
+    return numpy.histogram(num_retweets, bins = bins)
+
+
+def count_by_time_window(batch, window = 3600):
+    '''
+    Cuenta el número de tweets publicados en cada intervalo de tiempo.
+    :param window: Es la duración de los intervalos en segundos.
+    :return: Devuelve una tupla (inicio de cada intervalo como timestamp UNIX, número de tweets).
+    Solo se incluyen los intervalos con algún tweet.
+    '''
+    buckets, counts = group_sum(batch.get_column('timestamps') // window)
+    return buckets * window, counts
+
+
+def get_reach(batch):
+    '''
+    :return: Devuelve un array con el alcance de cada tweet: el número de seguidores de su autor.
+    '''
+    return batch.get_column('author_num_followers')[batch.get_column('author_indices')]
+
+
+def reach_by_time_window(batch, window = 3600):
+    '''
+    Es igual que count_by_time_window, solo que, en vez de contar los tweets, suma su alcance
+    (número de seguidores del autor de cada tweet)
+    '''
+    buckets, reach = group_sum(batch.get_column('timestamps') // window, get_reach(batch))
+    return buckets * window, reach
+
+
+def reach_by_author(batch):
+    '''
+    :return: Devuelve un array con el alcance acumulado de cada autor (número de tweets
+    multiplicado por su número de seguidores), indexado por el índice del autor.
+    '''
+    return count_by_author(batch) * batch.get_column('author_num_followers')
+
+
+if __name__ == '__main__':
+    # Comparamos el tiempo de ejecución de los análisis sobre una colección de tweets aleatorios,
+    # recorriendo los tweets uno a uno y usando las funciones de este script.
+    from random import Random
+    from time import time
+    from collections import Counter, defaultdict
+    from model.tweet import Tweet
+    from model.user import TwitterUser
+
+    num_tweets, num_authors = 200000, 5000
+    random = Random(0)
+    authors = [TwitterUser('user{}'.format(i), random.randint(0, 100000), random.randint(0, 1000)) for i in range(num_authors)]
+    tweets = [Tweet(random.choice(authors), str(i), '', random.choice(TweetBatch.post_types),
+                    random.randint(0, 1000), str(1500000000 + random.randint(0, 30 * 24 * 3600)))
+              for i in range(num_tweets)]
+
+    start_time = time()
+    batch = TweetBatch(tweets)
+    print('Construcción de TweetBatch: {:.3f}s'.format(time() - start_time))
+
+    def loop_analysis():
+        tweets_by_author = Counter(tweet.get_author().get_name() for tweet in tweets)
+        tweets_by_type = Counter(tweet.get_type() for tweet in tweets)
+        tweets_by_hour = Counter(int(tweet.get_timestamp()) // 3600 for tweet in tweets)
+        reach_by_hour = defaultdict(int)
+        for tweet in tweets:
+            reach_by_hour[int(tweet.get_timestamp()) // 3600] += tweet.get_author().get_num_followers()
+        total_retweets = sum(tweet.get_num_retweets() for tweet in tweets)
+
+    def vectorised_analysis():
+        count_by_author(batch)
+        post_type_ratios(batch)
+        count_by_time_window(batch)
+        reach_by_time_window(batch)
+        batch.get_column('num_retweets').sum()
+
+    for name, analysis in (('Bucle por objeto', loop_analysis), ('Vectorizado (numpy)', vectorised_analysis)):
+        start_time = time()
+        analysis()
+        print('{}: {:.3f}s'.format(name, time() - start_time))
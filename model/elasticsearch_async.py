@@ -0,0 +1,199 @@
+'''
+Este script define una versión asíncrona (asyncio) de la clase ElasticSearchCollector, que
+permite lanzar muchas consultas a la vez sobre una misma conexión HTTP (keep-alive) a
+elasticsearch.
+'''
+
+import asyncio
+import json
+from random import uniform
+
+import aiohttp
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.query import Match, Term
+
+from model.elasticsearch_parser import TweetDocumentParser, TWEET_SOURCE_FIELDS
+from model.metrics import get_metrics
+
+
+class ElasticSearchError(Exception):
+    '''
+    Error devuelto por elasticsearch.
+    '''
+    def __init__(self, status, reason):
+        super().__init__('Elasticsearch ha devuelto el error {}: {}'.format(status, reason))
+        self.status = status
+        self.reason = reason
+
+
+class TransientElasticSearchError(ElasticSearchError):
+    '''
+    Error temporal devuelto por elasticsearch (la consulta puede reintentarse)
+    '''
+    pass
+
+
+class AsyncElasticSearchCollector:
+    '''
+    Permite realizar consultas a elasticsearch de forma asíncrona.
+    Las consultas se reparten entre los hosts indicados. Si un host no responde (o devuelve un
+    error temporal), la consulta se reintenta en el siguiente host, esperando cada vez el doble
+    de tiempo, hasta que se supera el tiempo máximo de reintentos.
+    e.g:
+    async def main():
+        async with AsyncElasticSearchCollector() as collector:
+            queries = [Match(**{'body.es': name}) for name in ('@sanchezcastejon', '@marianorajoy')]
+            results = await asyncio.gather(*[collector.search_tweets(query) for query in queries])
+    '''
+
+    # Códigos de respuesta HTTP que indican un error temporal (la consulta se reintenta)
+    retry_status_codes = (429, 502, 503, 504)
+
+    def __init__(self, hosts = ('http://localhost:9220',), max_concurrent_queries = 10, request_timeout = 30,
+                 max_retry_time = 60, initial_backoff = 0.5, max_backoff = 10, index = 'shokesu', doc_type = 'posts'):
+        '''
+        Inicializa la instancia.
+        :param hosts: Lista de urls de los hosts de elasticsearch.
+        :param max_concurrent_queries: Número máximo de consultas en curso a la vez (y de
+        conexiones abiertas)
+        :param request_timeout: Tiempo máximo (en segundos) de cada petición HTTP.
+        :param max_retry_time: Tiempo máximo (en segundos) durante el que se reintenta una
+        consulta. Pasado este tiempo, se genera la última excepción obtenida.
+        :param initial_backoff: Tiempo de espera (en segundos) antes del primer reintento.
+        :param max_backoff: Tiempo de espera máximo entre reintentos.
+        :param index: Índice de elasticsearch sobre el que se realizan las consultas.
+        :param doc_type: Tipo de los documentos a consultar.
+        '''
+        self.hosts = [host.rstrip('/') for host in hosts]
+        self.max_concurrent_queries = max_concurrent_queries
+        self.request_timeout = request_timeout
+        self.max_retry_time = max_retry_time
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.index = index
+        self.doc_type = doc_type
+        self.parser = TweetDocumentParser()
+
+        # La sesión HTTP y el semáforo se crean la primera vez que se usan (deben crearse dentro
+        # del bucle de eventos de asyncio)
+        self.session = None
+        self.semaphore = None
+        self.next_host = 0
+
+
+    def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit = self.max_concurrent_queries)
+            self.session = aiohttp.ClientSession(connector = connector,
+                                                 timeout = aiohttp.ClientTimeout(total = self.request_timeout))
+            self.semaphore = asyncio.Semaphore(self.max_concurrent_queries)
+        return self.session
+
+
+    async def _request(self, method, path, body = None, data = None, headers = None):
+        '''
+        Envía una petición HTTP a elasticsearch.
+        :param path: Es la ruta de la petición (e.g: '/shokesu/posts/_search')
+        :param body: Es el cuerpo de la petición (se envía en formato JSON)
+        :param data: Es el cuerpo de la petición ya serializado (se usa si body es None)
+        :return: Devuelve la respuesta de elasticsearch (ya deserializada)
+        '''
+        session = self._get_session()
+        metrics = get_metrics()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_retry_time
+        backoff = self.initial_backoff
+        while True:
+            host = self.hosts[self.next_host % len(self.hosts)]
+            try:
+                async with self.semaphore:
+                    start_time = loop.time()
+                    async with session.request(method, host + path, json = body, data = data, headers = headers) as response:
+                        if response.status in self.retry_status_codes:
+                            raise TransientElasticSearchError(response.status, await response.text())
+                        if response.status >= 400:
+                            # Error no recuperable: no se reintenta.
+                            raise ElasticSearchError(response.status, await response.text())
+                        result = await response.json(content_type = None)
+                    metrics.observe('elasticsearch_request_seconds', loop.time() - start_time, kind = 'async')
+                    return result
+            except (aiohttp.ClientError, asyncio.TimeoutError, TransientElasticSearchError):
+                metrics.increment('elasticsearch_retries_total')
+                # Probamos con el siguiente host, tras esperar un tiempo aleatorio (para que las
+                # consultas no se reintenten todas a la vez)
+                self.next_host += 1
+                delay = uniform(backoff / 2, backoff)
+                if loop.time() + delay > deadline:
+                    raise
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+    def _build_search(self, query, first_doc = 0, num_docs = 10):
+        '''
+        :return: Devuelve el cuerpo de la consulta de tweets (un diccionario)
+        '''
+        query &= Term(provider = 'twitter')
+        request = Search().query(query).source(TWEET_SOURCE_FIELDS)
+        return request[first_doc:first_doc+num_docs].to_dict()
+
+
+    async def search_tweets(self, query, first_tweet = 0, num_tweets = 10):
+        '''
+        Es igual que el método ElasticSearchCollector.search_tweets, pero asíncrono.
+        :return: Devuelve una lista de tweets (instancias de la clase Tweet)
+        '''
+        body = self._build_search(query, first_tweet, num_tweets)
+        data = await self._request('POST', '/{}/{}/_search'.format(self.index, self.doc_type), body)
+        tweets, num_failures = self.parser.parse_batch(data['hits']['hits'])
+        return tweets
+
+
+    async def search_tweets_many(self, queries, first_tweet = 0, num_tweets = 10):
+        '''
+        Es igual que el método ElasticSearchCollector.search_tweets_many, pero asíncrono: todas
+        las queries se envían en una única request (_msearch)
+        :return: Devuelve una lista con el resultado de cada query (una lista de tweets)
+        '''
+        if len(queries) == 0:
+            return []
+        lines = []
+        for query in queries:
+            lines.append(json.dumps({}))
+            lines.append(json.dumps(self._build_search(query, first_tweet, num_tweets)))
+        data = await self._request('POST', '/{}/{}/_msearch'.format(self.index, self.doc_type),
+                                   data = '\n'.join(lines) + '\n', headers = {'Content-Type': 'application/x-ndjson'})
+
+        results = []
+        for response in data['responses']:
+            if 'error' in response:
+                raise ElasticSearchError(response.get('status'), response['error'])
+            tweets, num_failures = self.parser.parse_batch(response['hits']['hits'])
+            results.append(tweets)
+        return results
+
+
+    async def close(self):
+        '''
+        Cierra las conexiones abiertas.
+        '''
+        if not self.session is None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+if __name__ == '__main__':
+    async def main():
+        async with AsyncElasticSearchCollector() as collector:
+            queries = [Match(**{'body.es': name}) for name in ('@sanchezcastejon', '@marianorajoy', '@Albert_Rivera')]
+            results = await asyncio.gather(*[collector.search_tweets(query) for query in queries])
+            for query, posts in zip(queries, results):
+                print('{}: {} tweets'.format(query.to_dict(), len(posts)))
+
+    asyncio.run(main())
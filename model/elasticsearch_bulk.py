@@ -0,0 +1,267 @@
+'''
+Este script permite indexar tweets en elasticsearch (índice "shokesu") de forma eficiente,
+mediante la API _bulk: los tweets se agrupan en lotes (por número de documentos, tamaño en bytes
+y tiempo), y se envían varios lotes a la vez. Los documentos rechazados temporalmente por
+elasticsearch (e.g: cola de indexación llena) se reintentan individualmente.
+e.g:
+with BulkWriter() as writer:
+    writer.add_many(Tweet.search_by_terms('@sanchezcastejon', count = 1000))
+print(writer.get_stats())
+'''
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from random import uniform
+from threading import Condition, Event, Lock, Thread
+from time import sleep, time
+
+from elasticsearch.exceptions import ConnectionError, TransportError
+
+from model.elasticsearch_parser import tweet_to_document
+from model.metrics import get_metrics
+
+
+class BulkWriter:
+    '''
+    Indexa tweets en elasticsearch por lotes. Es seguro usar una misma instancia desde varios
+    hilos.
+    Los tweets se convierten en documentos con el mismo formato que el resto de documentos del
+    índice (ver elasticsearch_parser.tweet_to_document). La ID de cada documento es la ID del
+    tweet, de modo que indexar dos veces un mismo tweet lo actualiza.
+    '''
+
+    # Códigos de respuesta HTTP que indican un rechazo temporal (el documento o el lote se
+    # reintentan)
+    retry_status_codes = (429, 502, 503, 504)
+
+    def __init__(self, client = None, hosts = None, index = 'shokesu', doc_type = 'posts', max_batch_docs = 500,
+                 max_batch_bytes = 5 * 1024 * 1024, flush_interval = 1.0, max_in_flight = 4, max_retries = 5,
+                 initial_backoff = 0.5, max_backoff = 10):
+        '''
+        Inicializa la instancia.
+        :param client: Cliente de elasticsearch (una instancia de elasticsearch.Elasticsearch).
+        Si no se especifica, se crea uno con los hosts indicados (ver ElasticSearchCollector)
+        :param max_batch_docs: Número máximo de documentos de cada lote.
+        :param max_batch_bytes: Tamaño máximo (en bytes) de cada lote.
+        :param flush_interval: Tiempo máximo (en segundos) que un tweet espera a que se complete
+        su lote antes de enviarse. Si es None, los lotes incompletos solo se envían al invocar
+        los métodos flush o close.
+        :param max_in_flight: Número máximo de lotes que se envían a la vez. Cuando se alcanza,
+        los métodos add y add_many se bloquean hasta que finalice alguno.
+        :param max_retries: Número máximo de reintentos de cada documento rechazado temporalmente
+        (o de cada lote, si elasticsearch no responde)
+        :param initial_backoff: Tiempo de espera (en segundos) antes del primer reintento. Se
+        duplica en cada reintento, hasta max_backoff.
+        '''
+        if client is None:
+            from model.elasticsearch_utils import ElasticSearchCollector
+            client = ElasticSearchCollector(hosts).client
+        self.client = client
+        self.index = index
+        self.doc_type = doc_type
+        self.max_batch_docs = max_batch_docs
+        self.max_batch_bytes = max_batch_bytes
+        self.flush_interval = flush_interval
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.lock = Lock()
+        # Lote actual: lista de documentos (pares de líneas acción/documento, ya serializadas)
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_start_time = None
+        # Número de lotes enviándose (se notifica cada vez que finaliza uno)
+        self.num_in_flight = 0
+        self.in_flight_condition = Condition(self.lock)
+        self.executor = ThreadPoolExecutor(max_workers = max_in_flight)
+        self.closed = False
+
+        # Estadísticas
+        self.num_docs = 0
+        self.num_indexed = 0
+        self.num_retried = 0
+        self.num_failed = 0
+        self.num_bulks = 0
+        self.elapsed_time = 0.0
+        # Últimos errores no recuperables (para diagnosticar documentos rechazados)
+        self.errors = []
+
+        # Hilo que envía los lotes incompletos pasado flush_interval
+        self.stop_event = Event()
+        self.flush_thread = None
+        if not flush_interval is None:
+            self.flush_thread = Thread(target = self._flush_periodically, daemon = True)
+            self.flush_thread.start()
+
+
+    def _serialize(self, tweet):
+        action = {'index': {'_index': self.index, '_type': self.doc_type, '_id': tweet.get_id()}}
+        return (json.dumps(action).encode('utf-8') + b'\n' +
+                json.dumps(tweet_to_document(tweet), ensure_ascii = False).encode('utf-8') + b'\n')
+
+
+    def add(self, tweet):
+        '''
+        Añade un tweet a la cola de indexación.
+        '''
+        self.add_many([tweet])
+
+
+    def add_many(self, tweets):
+        '''
+        Añade varios tweets a la cola de indexación. Los lotes completos se envían en segundo
+        plano.
+        '''
+        docs = [self._serialize(tweet) for tweet in tweets]
+        with self.lock:
+            if self.closed:
+                raise ValueError('El BulkWriter está cerrado')
+            self.num_docs += len(docs)
+            for doc in docs:
+                if len(self.batch) > 0 and (len(self.batch) >= self.max_batch_docs or
+                                            self.batch_bytes + len(doc) > self.max_batch_bytes):
+                    self._submit_batch()
+                if len(self.batch) == 0:
+                    self.batch_start_time = time()
+                self.batch.append(doc)
+                self.batch_bytes += len(doc)
+            if len(self.batch) >= self.max_batch_docs:
+                self._submit_batch()
+
+
+    def _submit_batch(self):
+        '''
+        Envía el lote actual en segundo plano. Si ya se están enviando max_in_flight lotes,
+        espera a que finalice alguno. Debe invocarse con self.lock adquirido.
+        '''
+        batch = self.batch
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_start_time = None
+        while self.num_in_flight >= self.max_in_flight:
+            self.in_flight_condition.wait()
+        self.num_in_flight += 1
+        self.executor.submit(self._send, batch)
+
+
+    def _send(self, docs):
+        '''
+        Envía un lote a elasticsearch. Los documentos rechazados temporalmente se reenvían (en
+        un nuevo lote) hasta max_retries veces. Se ejecuta en un hilo del pool.
+        '''
+        metrics = get_metrics()
+        start_time = time()
+        num_indexed, num_retried, num_failed, num_bulks = 0, 0, 0, 0
+        errors = []
+        backoff = self.initial_backoff
+        try:
+            for attempt in range(0, self.max_retries + 1):
+                try:
+                    with metrics.timer('elasticsearch_bulk_seconds'):
+                        response = self.client.bulk(body = b''.join(docs))
+                    num_bulks += 1
+                    pending = []
+                    for doc, item in zip(docs, response['items']):
+                        result = next(iter(item.values()))
+                        status = result.get('status', 500)
+                        if status < 300:
+                            num_indexed += 1
+                        elif status in self.retry_status_codes:
+                            pending.append(doc)
+                        else:
+                            num_failed += 1
+                            errors.append(result.get('error'))
+                except (ConnectionError, TransportError) as e:
+                    # Si elasticsearch no responde o rechaza el lote completo, se reintentan
+                    # todos los documentos. Otros errores no se reintentan.
+                    if not isinstance(e, ConnectionError) and not e.status_code in self.retry_status_codes:
+                        raise
+                    pending = docs
+
+                if len(pending) == 0:
+                    break
+                if attempt == self.max_retries:
+                    num_failed += len(pending)
+                    errors.append('Se ha superado el número máximo de reintentos')
+                    break
+                num_retried += len(pending)
+                metrics.increment('elasticsearch_bulk_retries_total', len(pending))
+                docs = pending
+                sleep(uniform(backoff / 2, backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+        except Exception as e:
+            num_failed += len(docs)
+            errors.append(str(e))
+        finally:
+            if num_failed > 0:
+                metrics.increment('elasticsearch_bulk_failures_total', num_failed)
+            with self.lock:
+                self.num_indexed += num_indexed
+                self.num_retried += num_retried
+                self.num_failed += num_failed
+                self.num_bulks += num_bulks
+                self.elapsed_time += time() - start_time
+                self.errors = (self.errors + errors)[-100:]
+                self.num_in_flight -= 1
+                self.in_flight_condition.notify_all()
+
+
+    def _flush_periodically(self):
+        while not self.stop_event.wait(self.flush_interval / 2):
+            with self.lock:
+                if len(self.batch) > 0 and time() - self.batch_start_time >= self.flush_interval:
+                    self._submit_batch()
+
+
+    def flush(self):
+        '''
+        Envía el lote actual (aunque no esté completo) y espera a que finalicen todos los envíos
+        en curso.
+        '''
+        with self.lock:
+            if len(self.batch) > 0:
+                self._submit_batch()
+            while self.num_in_flight > 0:
+                self.in_flight_condition.wait()
+
+
+    def close(self):
+        '''
+        Envía los tweets pendientes y libera los recursos.
+        '''
+        if self.closed:
+            return
+        self.flush()
+        with self.lock:
+            self.closed = True
+        self.stop_event.set()
+        if not self.flush_thread is None:
+            self.flush_thread.join()
+        self.executor.shutdown()
+
+
+    def get_stats(self):
+        '''
+        :return: Devuelve un diccionario con el número de tweets añadidos, indexados, reintentos,
+        fallos (tweets no indexados), peticiones _bulk enviadas, tiempo total de las peticiones
+        y los últimos errores.
+        '''
+        with self.lock:
+            return {
+                'num_docs': self.num_docs,
+                'num_indexed': self.num_indexed,
+                'num_retried': self.num_retried,
+                'num_failed': self.num_failed,
+                'num_bulks': self.num_bulks,
+                'elapsed_time': self.elapsed_time,
+                'errors': list(self.errors)
+            }
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
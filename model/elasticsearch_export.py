@@ -0,0 +1,99 @@
+'''
+Este script permite exportar los tweets de elasticsearch (índice "shokesu") que encajan con una
+query a un fichero, en paralelo: la búsqueda se divide en varias partes (sliced scroll) y cada
+parte se lee y procesa en un proceso distinto.
+'''
+
+from multiprocessing import Pool, cpu_count
+from os import makedirs, remove
+from os.path import join
+from shutil import copyfileobj
+from time import time
+
+from elasticsearch_dsl.query import Q, Match
+
+from model.elasticsearch_utils import ElasticSearchCollector
+from model.tweet_sinks import open_sink
+
+
+def _export_slice(query, slice_id, num_slices, path, format, batch_size, scroll):
+    '''
+    Exporta una de las partes de la búsqueda. Se ejecuta en un proceso independiente.
+    :param query: Es la query en forma de diccionario.
+    :return: Devuelve un diccionario con estadísticas de la exportación de esta parte.
+    '''
+    start_time = time()
+    collector = ElasticSearchCollector()
+    sink = open_sink(path, format)
+    num_tweets = 0
+    batch = []
+    try:
+        for tweet in collector.iter_tweets(Q(query), batch_size, scroll, slice_id, num_slices):
+            batch.append(tweet)
+            if len(batch) == batch_size:
+                sink.write(batch)
+                num_tweets += len(batch)
+                batch = []
+        sink.write(batch)
+        num_tweets += len(batch)
+    finally:
+        sink.close()
+
+    elapsed_time = time() - start_time
+    return {
+        'slice_id': slice_id,
+        'path': path,
+        'num_tweets': num_tweets,
+        'num_failures': collector.parser.num_failures,
+        'elapsed_time': elapsed_time,
+        'tweets_per_second': num_tweets / elapsed_time if elapsed_time > 0 else 0.0
+    }
+
+
+def export_tweets(query, path, format = 'jsonl', num_slices = None, batch_size = 1000, scroll = '5m'):
+    '''
+    Exporta todos los tweets que encajan con la query indicada.
+    :param query: Es la query (una instancia de elasticsearch_dsl.query.Query)
+    :param path: Es la ruta del fichero de salida. Si el formato es 'jsonl', los tweets de todas
+    las partes se juntan en este fichero. Si el formato es 'parquet', se creará un directorio con
+    un fichero por cada parte.
+    :param format: Es el formato de salida: 'jsonl' o 'parquet'
+    :param num_slices: Número de partes en las que se divide la búsqueda (y número de procesos).
+    Por defecto es el número de cores.
+    :param batch_size: Número de documentos a consultar en cada lote.
+    :param scroll: Tiempo que elasticsearch mantiene abierto el contexto de cada búsqueda.
+    :return: Devuelve una lista con estadísticas de cada parte (número de tweets exportados,
+    número de documentos descartados, tiempo empleado y tweets por segundo)
+    '''
+    if num_slices is None:
+        num_slices = cpu_count()
+
+    if format == 'parquet':
+        makedirs(path, exist_ok = True)
+        paths = [join(path, 'part-{}.parquet'.format(slice_id)) for slice_id in range(0, num_slices)]
+    else:
+        paths = ['{}.part{}'.format(path, slice_id) for slice_id in range(0, num_slices)]
+
+    tasks = [(query.to_dict(), slice_id, num_slices, paths[slice_id], format, batch_size, scroll)
+             for slice_id in range(0, num_slices)]
+    with Pool(num_slices) as pool:
+        stats = sorted(pool.starmap(_export_slice, tasks), key = lambda slice_stats: slice_stats['slice_id'])
+
+    if format == 'jsonl':
+        # Juntamos los ficheros de cada parte
+        with open(path, 'wb') as file_handler:
+            for slice_path in paths:
+                with open(slice_path, 'rb') as slice_file_handler:
+                    copyfileobj(slice_file_handler, file_handler)
+                remove(slice_path)
+        for slice_stats in stats:
+            slice_stats['path'] = path
+
+    return stats
+
+
+if __name__ == '__main__':
+    query = Match(**{'body.es' : '@sanchezcastejon'})
+
+    for slice_stats in export_tweets(query, 'tweets.jsonl'):
+        print('Parte {slice_id}: {num_tweets} tweets en {elapsed_time:.2f}s ({tweets_per_second:.1f} tweets/s)'.format(**slice_stats))
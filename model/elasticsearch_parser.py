@@ -0,0 +1,163 @@
+'''
+Este script permite convertir los documentos obtenidos de elasticsearch (índice "shokesu") en
+instancias de la clase Tweet. Los documentos se procesan por lotes.
+También permite la conversión inversa (ver la función tweet_to_document)
+'''
+
+from datetime import datetime
+from re import compile
+from threading import Lock
+
+from model.metrics import get_metrics
+from model.tweet import Tweet
+from model.user import TwitterUser
+
+
+# Campos de los documentos que se usan para construir los tweets. Solo se solicitan estos
+# campos a elasticsearch (_source includes)
+TWEET_SOURCE_FIELDS = [
+    'provider', 'post_id', 'body', 'is_retweet', 'is_reply', 'retweet_count', 'retweet_id',
+    'published_at', 'user.followers_count', 'user.friends_count', 'user.screenname'
+]
+
+
+class TweetDocumentParser:
+    '''
+    Convierte documentos de elasticsearch en tweets.
+    Las fechas de publicación ya procesadas se guardan en memoria (los tweets de una misma
+    búsqueda suelen publicarse en el mismo minuto), y los autores de cada lote se comparten entre
+    los tweets que pertenecen a un mismo usuario.
+    '''
+
+    # Número máximo de fechas que se guardan en memoria.
+    max_cached_dates = 100000
+
+    date_pattern = compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})T(\d{1,2}):(\d{1,2})$')
+
+    def __init__(self):
+        self.timestamps = {}
+        self.lock = Lock()
+        # Número total de documentos procesados y de documentos que no pudieron procesarse
+        self.num_docs = 0
+        self.num_failures = 0
+
+
+    def parse_timestamp(self, published_at):
+        '''
+        Convierte la fecha de publicación de un documento (e.g: '2018-05-12T10:23+02:00' o
+        '2018-05-12T04:23-04:00') en un timestamp UNIX.
+        :return: Devuelve el timestamp (un string), o genera una excepción si la fecha no es válida.
+        '''
+        # La zona horaria empieza por '+' o '-' (la fecha también contiene '-', pero antes de la T)
+        index = max(published_at.rfind('+'), published_at.rfind('-'))
+        date = published_at[:index]
+        timestamp = self.timestamps.get(date)
+        if timestamp is None:
+            result = self.date_pattern.match(date)
+            if not result:
+                raise ValueError('Fecha no válida: {}'.format(published_at))
+            timestamp = datetime(*[int(strnum) for strnum in result.groups()]).strftime('%s')
+            if len(self.timestamps) >= self.max_cached_dates:
+                self.timestamps.clear()
+            self.timestamps[date] = timestamp
+        return timestamp
+
+
+    def parse(self, doc, authors = None):
+        '''
+        Convierte un documento en una instancia de la clase Tweet.
+        :param authors: Es un diccionario opcional donde se guardan los autores ya creados, para
+        compartirlos entre distintos tweets.
+        :return: Devuelve el tweet. Genera una excepción si el documento no es válido.
+        '''
+        source = doc['_source']
+
+        # Comprobamos que el proveedor del documento es twitter
+        if not source['provider'] == 'twitter':
+            raise ValueError('El documento no es un tweet')
+
+        is_retweet = source['is_retweet']
+        is_reply = source['is_reply']
+        post_type = 'retweet' if is_retweet else ('reply' if is_reply else 'original')
+        retweet_id = source['retweet_id'] if post_type == 'retweet' else None
+        reply_id = source['retweet_id'] if post_type == 'reply' else None
+        timestamp = self.parse_timestamp(source['published_at'])
+
+        user_data = source['user']
+        author_key = (user_data['screenname'], user_data['followers_count'], user_data['friends_count'])
+        author = authors.get(author_key) if not authors is None else None
+        if author is None:
+            author = TwitterUser(*author_key)
+            if not authors is None:
+                authors[author_key] = author
+
+        return Tweet(author, source['post_id'], next(iter(source['body'].values())), post_type,
+                     source['retweet_count'], timestamp, retweet_id, reply_id)
+
+
+    def parse_batch(self, docs):
+        '''
+        Convierte un lote de documentos en tweets. Los documentos que no son válidos se descartan.
+        :return: Devuelve una tupla (tweets, número de documentos que no pudieron procesarse)
+        '''
+        authors = {}
+        tweets = []
+        num_failures = 0
+        for doc in docs:
+            try:
+                tweets.append(self.parse(doc, authors))
+            except (KeyError, TypeError, ValueError, StopIteration, AttributeError):
+                num_failures += 1
+
+        with self.lock:
+            self.num_docs += len(tweets) + num_failures
+            self.num_failures += num_failures
+        if num_failures > 0:
+            get_metrics().increment('elasticsearch_parse_failures_total', num_failures)
+        return tweets, num_failures
+
+
+def tweet_to_document(tweet):
+    '''
+    Convierte un tweet en un documento de elasticsearch (el campo _source), con el mismo formato
+    que los documentos del índice "shokesu". Es la operación inversa a TweetDocumentParser.parse
+    La fecha de publicación se expresa en la zona horaria local (la misma que se usa al
+    parsearla)
+    '''
+    author = tweet.get_author()
+    post_type = tweet.get_type()
+    published_at = datetime.fromtimestamp(int(tweet.get_timestamp())).astimezone().strftime('%Y-%m-%dT%H:%M%z')
+    return {
+        'provider': 'twitter',
+        'post_id': tweet.get_id(),
+        'body': {'es': tweet.get_text()},
+        'is_retweet': post_type == 'retweet',
+        'is_reply': post_type == 'reply',
+        'retweet_count': tweet.get_num_retweets(),
+        # El campo retweet_id contiene la ID del tweet retweeteado o respondido.
+        'retweet_id': tweet.get_retweet_id() if post_type == 'retweet' else tweet.get_reply_id(),
+        'published_at': published_at[:-2] + ':' + published_at[-2:],
+        'user': {
+            'screenname': author.get_name(),
+            'followers_count': author.get_num_followers(),
+            'friends_count': author.get_num_friends()
+        }
+    }
+
+
+if __name__ == '__main__':
+    # Comprobamos que los documentos generados por tweet_to_document se parsean correctamente,
+    # con zonas horarias al este y al oeste de UTC.
+    import os
+    from time import tzset
+
+    author = TwitterUser('usuario', 100, 10)
+    for tz in ('UTC', 'Europe/Madrid', 'America/New_York', 'Asia/Kolkata'):
+        os.environ['TZ'] = tz
+        tzset()
+        for timestamp in ('1526113380', '1545730200'):
+            tweet = Tweet(author, '1', 'hola', 'original', 0, timestamp, None, None)
+            doc = tweet_to_document(tweet)
+            parsed = TweetDocumentParser().parse({'_source': doc})
+            assert parsed.get_timestamp() == timestamp, (tz, doc['published_at'], parsed.get_timestamp())
+            print('{}: {} -> {}'.format(tz, doc['published_at'], parsed.get_timestamp()))
@@ -1,27 +1,56 @@
 
-from datetime import datetime
-from re import match
+from time import sleep, time
+from random import uniform
+from collections import namedtuple
 
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConnectionTimeout
-from elasticsearch_dsl import Search
-from elasticsearch_dsl.query import Match, Term
+from elasticsearch.helpers import scan
+from elasticsearch_dsl import Search, MultiSearch, A
+from elasticsearch_dsl.query import Match, Term, Q
 
-from model.tweet import Tweet
-from model.user import TwitterUser
+from model.elasticsearch_parser import TweetDocumentParser, TWEET_SOURCE_FIELDS
+from model.metrics import get_metrics
+
+
+# Resultados de las agregaciones (ver ElasticSearchCollector.count_tweets_by_term y siguientes)
+TermCount = namedtuple('TermCount', ['key', 'count'])
+DateCount = namedtuple('DateCount', ['timestamp', 'count'])
+PostTypeCounts = namedtuple('PostTypeCounts', ['original', 'retweet', 'reply'])
+FieldStats = namedtuple('FieldStats', ['count', 'min', 'max', 'avg', 'sum'])
 
 
 class ElasticSearchCollector:
     '''
     Esta clase permite realizar consultas a la base de datos...
     '''
-    def __init__(self):
-        hosts = [
-            {'host': 'localhost', 'port': '9220', 'use_ssl': False}
-        ]
-        self.client = Elasticsearch(hosts = hosts)
 
-    def _search(self, query, first_doc = 0, num_docs = 10):
+    # Hosts de elasticsearch por defecto
+    default_hosts = [
+        {'host': 'localhost', 'port': '9220', 'use_ssl': False}
+    ]
+
+    # Si elasticsearch no responde, las consultas se reintentan esperando cada vez el doble de
+    # tiempo (desde initial_backoff hasta max_backoff segundos), durante max_retry_time segundos
+    # como máximo.
+    initial_backoff = 0.5
+    max_backoff = 30
+    max_retry_time = 300
+
+    # Campos de los documentos usados en las agregaciones
+    author_field = 'user.screenname'
+    date_field = 'published_at'
+
+    def __init__(self, hosts = None):
+        '''
+        Inicializa la instancia.
+        :param hosts: Es la lista de hosts de elasticsearch (en el formato que admite la clase
+        elasticsearch.Elasticsearch). Por defecto se usa default_hosts
+        '''
+        self.client = Elasticsearch(hosts = hosts if not hosts is None else self.default_hosts)
+        self.parser = TweetDocumentParser()
+
+    def _search(self, query, first_doc = 0, num_docs = 10, fields = None):
         '''
         Envía la request a elasticsearch.
         :param request: Es la request a envíar, una instancia preparada de la clase
@@ -29,88 +58,246 @@ class ElasticSearchCollector:
         :param first_doc Es un índice que indica el primer documento a devolver (sirve para páginar
         los resultados)
         :param num_docs Es el número de documentos a devolver
+        :param fields Si se especifica, es la lista de campos de los documentos a devolver (el
+        resto de campos no se descargan)
         :return: Si la request fue ejecutada con éxito, devuelve un listado de los documentos
         obtenidos con la query (con información y metainformación del documento en forma de
         diccionario)
-        En caso contrario, si la request fallo, se genera una excepción
+        En caso contrario, si la request fallo, se genera una excepción. Si elasticsearch no
+        responde, la request se reintenta durante max_retry_time segundos; pasado este tiempo se
+        genera la excepción ConnectionTimeout
 
         Solo se buscarán documentos en el índice "shokesu" del tipo "posts"
         '''
 
         request = Search(index = 'shokesu', doc_type = 'posts')
         request = request[first_doc:first_doc+num_docs]
-        while True:
-            try:
-                result = request.using(client = self.client).query(query).execute(ignore_cache = False)
-                if not result.success():
-                    raise Exception()
-                break
-            except ConnectionTimeout:
-                pass
+        if not fields is None:
+            request = request.source(fields)
+        result = self._execute(request.using(client = self.client).query(query))
 
         data = result.to_dict()
         docs = data['hits']['hits']
         return docs
 
 
+    def _execute(self, request):
+        '''
+        Ejecuta una request (una instancia de elasticsearch_dsl.Search o
+        elasticsearch_dsl.MultiSearch). Si elasticsearch no responde, la request se reintenta
+        (ver el método _search)
+        :return: Devuelve la respuesta de elasticsearch.
+        '''
+        metrics = get_metrics()
+        deadline = time() + self.max_retry_time
+        backoff = self.initial_backoff
+        while True:
+            try:
+                with metrics.timer('elasticsearch_request_seconds', kind = type(request).__name__):
+                    result = request.execute(ignore_cache = False)
+                if isinstance(request, Search) and not result.success():
+                    raise Exception()
+                return result
+            except ConnectionTimeout:
+                metrics.increment('elasticsearch_retries_total')
+                # Esperamos un tiempo aleatorio (para que los clientes no reintenten a la vez)
+                delay = uniform(backoff / 2, backoff)
+                if time() + delay > deadline:
+                    raise
+                sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+
+
     def search_tweets(self, query, first_tweet = 0, num_tweets = 10):
         '''
         Es igual que el método anterior, solo que el resultado de la query es parseado
         (convierte cada documento en forma de diccionario, en instancias de la clase Tweet)
         Además, se refinará la busqueda sobre elasticsearch de modo que solo se busquen aquellos
         documentos cuyo proveedor es twitter.
+        Solo se descargan los campos necesarios para construir los tweets. Los documentos que no
+        pueden procesarse se descartan (el número total de descartes puede consultarse en
+        self.parser.num_failures)
+        '''
+
+        query &= Term(provider = 'twitter')
+        docs = self._search(query, first_doc = first_tweet, num_docs = num_tweets, fields = TWEET_SOURCE_FIELDS)
+
+        posts, num_failures = self.parser.parse_batch(docs)
+        return posts
+
+
+    def search_tweets_many(self, queries, first_tweet = 0, num_tweets = 10):
+        '''
+        Es igual que el método anterior, solo que realiza varias búsquedas a la vez. Todas las
+        búsquedas se envían en una única request a elasticsearch (_msearch)
+        :param queries: Es un listado de queries.
+        :return: Devuelve una lista con el resultado de cada query (una lista de tweets), en el
+        mismo orden que las queries.
         '''
+        if len(queries) == 0:
+            return []
+        request = MultiSearch(index = 'shokesu', doc_type = 'posts').using(client = self.client)
+        for query in queries:
+            query &= Term(provider = 'twitter')
+            request = request.add(Search().query(query).source(TWEET_SOURCE_FIELDS)[first_tweet:first_tweet+num_tweets])
+
+        results = []
+        for result in self._execute(request):
+            posts, num_failures = self.parser.parse_batch(result.to_dict()['hits']['hits'])
+            results.append(posts)
+        return results
 
+
+    def _aggregate(self, query, aggs):
+        '''
+        Ejecuta agregaciones sobre los tweets que encajan con la query. Elasticsearch realiza
+        el cálculo y solo devuelve el resultado (no se descarga ningún documento)
+        :param aggs: Es un diccionario nombre -> agregación (instancias de
+        elasticsearch_dsl.A)
+        :return: Devuelve un diccionario nombre -> resultado de la agregación.
+        '''
         query &= Term(provider = 'twitter')
-        docs = self._search(query, first_doc = first_tweet, num_docs = num_tweets)
+        request = Search(index = 'shokesu', doc_type = 'posts').using(client = self.client).query(query)
+        request = request.extra(size = 0)
+        for name, agg in aggs.items():
+            request.aggs[name] = agg
+        return self._execute(request).to_dict()['aggregations']
 
 
-        def parse(doc):
-            source = doc['_source']
+    def count_tweets_by_term(self, query, field, size = 10):
+        '''
+        Cuenta los tweets que encajan con la query, agrupados por el valor de un campo (agregación
+        terms)
+        :param field: Es el campo por el que se agrupan los tweets.
+        :param size: Es el número máximo de grupos a devolver (los que tienen más tweets)
+        :return: Devuelve una lista de tuplas TermCount(key, count), ordenadas de mayor a
+        menor número de tweets.
+        '''
+        result = self._aggregate(query, {'terms': A('terms', field = field, size = size)})
+        return [TermCount(bucket['key'], bucket['doc_count']) for bucket in result['terms']['buckets']]
 
-            # Comprobamos que el proveedor del documento es twitter
-            provider = source['provider']
-            if not provider == 'twitter':
-                raise Exception()
 
-            id = source['post_id']
-            text = next(iter(source['body'].values()))
-            is_retweet = source['is_retweet']
-            is_reply  = source['is_reply']
-            post_type = 'retweet' if is_retweet else ('reply' if is_reply else 'original')
-            num_retweets = source['retweet_count']
-            retweet_id = source['retweet_id'] if post_type == 'retweet' else None
-            reply_id = source['retweet_id'] if post_type == 'reply' else None
-            author = None
+    def count_tweets_by_author(self, query, size = 10):
+        '''
+        Es igual que el método anterior, solo que agrupa los tweets por su autor.
+        :return: Devuelve una lista de tuplas TermCount(nombre del autor, número de tweets)
+        '''
+        return self.count_tweets_by_term(query, self.author_field, size)
 
-            result = match('^(\d{4})\-(\d{1,2})\-(\d{1,2})T(\d{1,2})\:(\d{1,2})\+.*$', source['published_at'])
-            if not result:
-                raise Exception()
-            timestamp = datetime(*[int(strnum) for strnum in result.groups()]).strftime('%s')
 
-            user_data = source['user']
-            num_followers = user_data['followers_count']
-            num_friends = user_data['friends_count']
-            screen_name = user_data['screenname']
-            author = TwitterUser(screen_name, num_followers, num_friends)
+    def count_tweets_by_date(self, query, interval = 'day', time_zone = None):
+        '''
+        Cuenta los tweets que encajan con la query, agrupados por su fecha de publicación
+        (agregación date_histogram)
+        :param interval: Es el tamaño de los intervalos de tiempo ('hour', 'day', 'week', '30m',
+        ...)
+        :param time_zone: Zona horaria usada para calcular los intervalos (e.g: 'Europe/Madrid').
+        Por defecto es UTC
+        :return: Devuelve una lista de tuplas DateCount(timestamp, count), ordenadas por fecha,
+        donde timestamp es el timestamp UNIX del inicio de cada intervalo.
+        '''
+        params = {'field': self.date_field, 'interval': interval, 'min_doc_count': 1}
+        if not time_zone is None:
+            params['time_zone'] = time_zone
+        result = self._aggregate(query, {'dates': A('date_histogram', **params)})
+        return [DateCount(bucket['key'] // 1000, bucket['doc_count']) for bucket in result['dates']['buckets']]
+
 
-            tweet = Tweet(author, id, text, post_type, num_retweets, timestamp, retweet_id, reply_id)
+    def count_tweets_by_type(self, query):
+        '''
+        Cuenta los tweets que encajan con la query, según su tipo (agregación filters)
+        :return: Devuelve una tupla PostTypeCounts(original, retweet, reply)
+        '''
+        retweet = Q('term', is_retweet = True)
+        reply = Q('term', is_reply = True)
+        filters = {
+            'original': ~retweet & ~reply,
+            'retweet': retweet,
+            'reply': reply & ~retweet
+        }
+        result = self._aggregate(query, {'types': A('filters', filters = filters)})
+        buckets = result['types']['buckets']
+        return PostTypeCounts(**{post_type: buckets[post_type]['doc_count'] for post_type in filters})
 
-            return tweet
 
-        posts = []
+    def get_tweet_stats(self, query, fields = ('retweet_count', 'user.followers_count')):
+        '''
+        Calcula estadísticas de campos numéricos de los tweets que encajan con la query
+        (agregación stats)
+        :param fields: Son los campos de los que se calculan las estadísticas.
+        :return: Devuelve un diccionario campo -> FieldStats(count, min, max, avg, sum). Si
+        ningún tweet encaja con la query, count es 0 y el resto de valores son None
+        '''
+        result = self._aggregate(query, {field: A('stats', field = field) for field in fields})
+        return {field: FieldStats(*[result[field][key] for key in FieldStats._fields]) for field in fields}
+
+
+    def index_tweets(self, tweets, **kwargs):
+        '''
+        Indexa tweets en elasticsearch (ver model.elasticsearch_bulk.BulkWriter)
+        :param tweets: Es un listado (o un iterable) de tweets.
+        :param kwargs: Parámetros adicionales del BulkWriter (e.g: max_in_flight)
+        :return: Devuelve un diccionario con estadísticas de la indexación (ver
+        BulkWriter.get_stats)
+        '''
+        with BulkWriter(client = self.client, **kwargs) as writer:
+            batch = []
+            for tweet in tweets:
+                batch.append(tweet)
+                if len(batch) == writer.max_batch_docs:
+                    writer.add_many(batch)
+                    batch = []
+            writer.add_many(batch)
+        return writer.get_stats()
+
+
+    def iter_tweets(self, query, batch_size = 1000, scroll = '5m', slice_id = None, num_slices = None):
+        '''
+        Es igual que el método anterior, solo que devuelve todos los tweets que encajan con la
+        query. Los documentos se obtienen por lotes mediante la API scroll de elasticsearch,
+        de forma que el coste de cada lote no depende de su posición y no hay límite en el número
+        de documentos (max_result_window).
+        :param batch_size: Es el número de documentos a consultar en cada lote.
+        :param scroll: Tiempo que elasticsearch mantendrá abierto el contexto de la búsqueda
+        entre un lote y el siguiente.
+        :param slice_id: Si se especifica junto con num_slices, la búsqueda se divide en
+        num_slices partes disjuntas (sliced scroll) y solo se devuelven los tweets de la parte
+        indicada (0 <= slice_id < num_slices). Permite repartir una misma búsqueda entre
+        distintos procesos.
+        :return: Devuelve un generador que proporciona los tweets (instancias de la clase Tweet)
+        '''
+        query &= Term(provider = 'twitter')
+        request = Search(index = 'shokesu', doc_type = 'posts').query(query).source(TWEET_SOURCE_FIELDS)
+        if not num_slices is None and num_slices > 1:
+            request = request.extra(slice = {'id': slice_id, 'max': num_slices})
+
+        docs = scan(self.client, query = request.to_dict(), index = 'shokesu', doc_type = 'posts',
+                    size = batch_size, scroll = scroll)
+
+        # Los documentos se procesan por lotes
+        batch = []
         for doc in docs:
-            try:
-                post = parse(doc)
-                posts.append(post)
-            except:
-                pass
-        return posts
+            batch.append(doc)
+            if len(batch) == batch_size:
+                posts, num_failures = self.parser.parse_batch(batch)
+                yield from posts
+                batch = []
+        posts, num_failures = self.parser.parse_batch(batch)
+        yield from posts
+
 
+from model.elasticsearch_bulk import BulkWriter
 
 if __name__ == '__main__':
     query = Match(**{'body.es' : '@sanchezcastejon'})
 
-    posts = ElasticSearchCollector().search_tweets(query)
+    collector = ElasticSearchCollector()
+    posts = collector.search_tweets(query)
     for post in posts:
         print(post)
+
+    # Agregaciones (se calculan en elasticsearch)
+    print(collector.count_tweets_by_author(query))
+    print(collector.count_tweets_by_date(query, interval = 'day'))
+    print(collector.count_tweets_by_type(query))
+    print(collector.get_tweet_stats(query))
@@ -0,0 +1,144 @@
+'''
+Este script permite extraer las urls que aparecen en el texto de los tweets, junto con sus hosts
+(normalizados), en una sola pasada sobre el texto y usando expresiones regulares precompiladas.
+'''
+
+from re import compile, IGNORECASE
+
+
+class LinkExtractor:
+    '''
+    Extrae urls y hosts de textos.
+    Los hosts se normalizan: se pasan a minúsculas y se eliminan el prefijo "www.", el puerto y
+    el punto final (si lo hay). Los hosts de los dominios excluidos (y sus subdominios) se
+    descartan.
+    '''
+
+    # Cada coincidencia es una url (grupo 1) y su host sin el prefijo "www." (grupo 2)
+    link_pattern = compile(r'(https?://(?:www\.)?([^/\s?#]+)(?:[/?#]\S*)?)')
+    # Igual que el anterior, pero sin distinguir mayúsculas y minúsculas (e.g: "HTTPS://"). Es
+    # bastante más lento, de modo que solo se usa si el anterior no encuentra todas las urls.
+    link_pattern_ignorecase = compile(link_pattern.pattern, IGNORECASE)
+    # Igual que el anterior, pero para analizar una url completa.
+    url_pattern = compile(r'^https?://(?:www\.)?([^/\s?#]+)', IGNORECASE)
+
+    def __init__(self, excluded_domains = ('twitter.com', 't.co')):
+        '''
+        Inicializa la instancia.
+        :param excluded_domains: Dominios cuyos hosts se descartan.
+        '''
+        self.excluded_domains = frozenset(domain.lower() for domain in excluded_domains)
+        # Hosts ya normalizados (host original -> host normalizado o None si está excluido)
+        self.hosts = {}
+
+
+    def normalize_host(self, host):
+        '''
+        Normaliza un host.
+        :return: Devuelve el host normalizado, o None si pertenece a un dominio excluido.
+        '''
+        normalized = self.hosts.get(host, False)
+        if normalized is False:
+            normalized = host.lower().rsplit('@', 1)[-1].split(':', 1)[0].rstrip('.')
+            if normalized.startswith('www.'):
+                normalized = normalized[4:]
+            if self.is_excluded(normalized):
+                normalized = None
+            if len(self.hosts) > 100000:
+                self.hosts.clear()
+            self.hosts[host] = normalized
+        return normalized
+
+
+    def is_excluded(self, host):
+        '''
+        :return: Devuelve True si el host (normalizado) pertenece a alguno de los dominios
+        excluidos.
+        '''
+        if host in self.excluded_domains:
+            return True
+        index = host.find('.')
+        while index >= 0:
+            if host[index+1:] in self.excluded_domains:
+                return True
+            index = host.find('.', index + 1)
+        return False
+
+
+    def extract(self, text):
+        '''
+        Extrae las urls de un texto.
+        :return: Devuelve una lista de tuplas (url, host normalizado). El host es None si
+        pertenece a un dominio excluido.
+        '''
+        # La mayoría de los tweets no tienen urls
+        if not '://' in text:
+            return []
+        matches = self.link_pattern.findall(text)
+        if len(matches) < text.count('://'):
+            matches = self.link_pattern_ignorecase.findall(text)
+        hosts = self.hosts
+        normalize_host = self.normalize_host
+        return [(link, hosts[host] if host in hosts else normalize_host(host))
+                for link, host in matches]
+
+
+    def extract_batch(self, texts):
+        '''
+        Igual que el método anterior, pero para varios textos.
+        :return: Devuelve una lista con el resultado de cada texto.
+        '''
+        return [self.extract(text) for text in texts]
+
+
+    def get_host(self, url):
+        '''
+        :return: Devuelve el host normalizado de la url indicada, o None si no es una url válida
+        o pertenece a un dominio excluido.
+        '''
+        result = self.url_pattern.match(url)
+        return self.normalize_host(result.group(1)) if result else None
+
+
+    def get_hosts(self, urls):
+        '''
+        :return: Devuelve una lista con los hosts distintos de las urls indicadas (se descartan
+        los hosts excluidos y las urls que son None)
+        '''
+        hosts = [self.get_host(url) for url in urls if not url is None]
+        return list(dict.fromkeys(host for host in hosts if not host is None))
+
+
+# Instancia por defecto (excluye twitter.com y t.co)
+default_link_extractor = LinkExtractor()
+
+
+if __name__ == '__main__':
+    # Comparamos el tiempo de extracción de hosts sobre un corpus de tweets aleatorios, usando
+    # el método original (findall + match por cada url) y la clase LinkExtractor. Se muestra el
+    # mejor tiempo de varias ejecuciones.
+    from random import Random
+    from re import findall, match
+    from timeit import repeat
+
+    random = Random(0)
+    words = ['el', 'gobierno', 'presidente', 'elecciones', '#debate', '@usuario', 'hoy', 'RT', 'vía', 'que']
+    characters = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    links = ['https://t.co/' + ''.join(random.choice(characters) for i in range(10)) for j in range(1000)]
+    links += ['https://www.elpais.com/politica/2018/{}.html'.format(i) for i in range(200)]
+    links += ['http://bit.ly/{}'.format(i) for i in range(200)] + ['https://twitter.com/i/web/status/{}'.format(i) for i in range(200)]
+    texts = [' '.join(random.choice(words) for i in range(random.randint(5, 20))) + ' ' +
+             ' '.join(random.choice(links) for i in range(random.randint(0, 3)))
+             for j in range(100000)]
+
+    def original(text):
+        urls = [full_url for full_url, path_and_query in findall('(https?\\:\\/\\/[^\\/]+(\\/[^ ]+)?)', text)]
+        hosts = [match('^https?\\:\\/\\/(www\\.)?([^\\/]+)(\\/.*)?$', url).group(2) for url in urls]
+        return list(set(hosts) - set(['twitter.com', 't.co']))
+
+    extractor = LinkExtractor()
+    for name, extract in (('Original', lambda: [original(text) for text in texts]),
+                          ('LinkExtractor', lambda: [list(dict.fromkeys(host for url, host in links if not host is None))
+                                                     for links in extractor.extract_batch(texts)])):
+        elapsed_time = min(repeat(extract, number = 1, repeat = 5))
+        print('{}: {:.3f}s ({:.0f} tweets/s)'.format(name, elapsed_time, len(texts) / elapsed_time))
@@ -0,0 +1,253 @@
+'''
+Este script define la capa de instrumentación (métricas) usada por los módulos que realizan
+operaciones de entrada/salida (API de twitter, elasticsearch, resolución de urls, ...)
+Se registran contadores (e.g: número de reintentos) e histogramas de latencias (e.g: tiempo de
+espera de las claves de la API). Por defecto las métricas no se registran (NullMetrics). Para
+activarlas:
+
+set_metrics(InMemoryMetrics())
+...
+print(get_metrics().snapshot())
+serve_metrics(9100)   # Exporta las métricas en formato Prometheus (http://localhost:9100/metrics)
+'''
+
+from bisect import bisect_left
+from threading import Lock, Thread
+from time import perf_counter
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _Timer:
+    '''
+    Mide el tiempo que tarda en ejecutarse un bloque de código (with) y lo registra en un
+    histograma.
+    '''
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start_time = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, perf_counter() - self.start_time, **self.labels)
+
+
+class NullMetrics:
+    '''
+    Métricas por defecto: no registra nada (su coste es prácticamente nulo).
+    Las subclases deben redefinir los métodos increment y observe.
+    '''
+
+    _null_timer = _NullTimer()
+
+    def increment(self, name, value = 1, **labels):
+        '''
+        Incrementa un contador.
+        :param name: Es el nombre del contador (e.g: 'elasticsearch_retries_total')
+        :param value: Es la cantidad a sumar.
+        :param labels: Etiquetas adicionales del contador (e.g: endpoint = 'search')
+        '''
+        pass
+
+    def observe(self, name, value, **labels):
+        '''
+        Registra un valor (e.g: una latencia en segundos) en un histograma.
+        '''
+        pass
+
+    def timer(self, name, **labels):
+        '''
+        :return: Devuelve un context manager que registra en el histograma indicado el tiempo (en
+        segundos) que tarda en ejecutarse el bloque with.
+        e.g:
+        with get_metrics().timer('elasticsearch_request_seconds'):
+            ...
+        '''
+        return self._null_timer
+
+    def snapshot(self):
+        '''
+        :return: Devuelve un diccionario con el valor actual de las métricas.
+        '''
+        return {'counters': {}, 'histograms': {}}
+
+    def to_prometheus(self):
+        '''
+        :return: Devuelve las métricas en el formato de texto de Prometheus.
+        '''
+        return ''
+
+
+class InMemoryMetrics(NullMetrics):
+    '''
+    Registra las métricas en memoria. Es seguro usar una misma instancia desde varios hilos.
+    '''
+
+    # Límites superiores (en segundos) de los intervalos de los histogramas
+    default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+    def __init__(self, buckets = None):
+        '''
+        Inicializa la instancia.
+        :param buckets: Límites superiores de los intervalos de los histogramas (ordenados). Por
+        defecto se usa default_buckets
+        '''
+        self.buckets = tuple(buckets) if not buckets is None else self.default_buckets
+        self.lock = Lock()
+        # Diccionario (nombre, etiquetas) -> valor
+        self.counters = {}
+        # Diccionario (nombre, etiquetas) -> [número de valores en cada intervalo, suma, número de valores]
+        self.histograms = {}
+
+
+    def increment(self, name, value = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.histograms[key] = histogram
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+
+    def snapshot(self):
+        '''
+        :return: Devuelve un diccionario con dos entradas: 'counters' (diccionario
+        (nombre, etiquetas) -> valor) y 'histograms' (diccionario (nombre, etiquetas) ->
+        diccionario con el número de valores, su suma, su media y el número de valores en cada
+        intervalo). Las etiquetas son una tupla de pares (etiqueta, valor)
+        '''
+        with self.lock:
+            histograms = {}
+            for key, (counts, total, count) in self.histograms.items():
+                histograms[key] = {
+                    'count': count,
+                    'sum': total,
+                    'avg': total / count if count > 0 else 0.0,
+                    'buckets': dict(zip(self.buckets + (float('inf'),), counts))
+                }
+            return {'counters': dict(self.counters), 'histograms': histograms}
+
+
+    def to_prometheus(self):
+        def format_labels(labels):
+            if len(labels) == 0:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for label, value in labels) + '}'
+
+        lines = []
+        with self.lock:
+            types = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                if not name in types:
+                    types[name] = 'counter'
+                    lines.append('# TYPE {} counter'.format(name))
+                lines.append('{}{} {}'.format(name, format_labels(labels), value))
+
+            for (name, labels), (counts, total, count) in sorted(self.histograms.items()):
+                if not name in types:
+                    types[name] = 'histogram'
+                    lines.append('# TYPE {} histogram'.format(name))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', bound),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), total))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+    def reset(self):
+        '''
+        Elimina todas las métricas registradas.
+        '''
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# Métricas usadas por todos los módulos (por defecto no se registra nada)
+_metrics = NullMetrics()
+
+def get_metrics():
+    '''
+    :return: Devuelve la instancia de métricas actual.
+    '''
+    return _metrics
+
+def set_metrics(metrics):
+    '''
+    Establece la instancia de métricas usada por todos los módulos (e.g: InMemoryMetrics()). Si
+    es None, se desactivan las métricas.
+    :return: Devuelve la instancia establecida.
+    '''
+    global _metrics
+    _metrics = metrics if not metrics is None else NullMetrics()
+    return _metrics
+
+
+def serve_metrics(port = 9100, host = '', metrics = None):
+    '''
+    Inicia un servidor HTTP en segundo plano que exporta las métricas en el formato de
+    texto de Prometheus (ruta /metrics)
+    :param metrics: Instancia de métricas a exportar. Por defecto se exportan las métricas
+    actuales (ver get_metrics)
+    :return: Devuelve el servidor (una instancia de http.server.HTTPServer). Se detiene con su
+    método shutdown
+    '''
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.split('?', 1)[0] in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = (metrics if not metrics is None else get_metrics()).to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    from random import expovariate
+
+    metrics = set_metrics(InMemoryMetrics())
+    for i in range(0, 1000):
+        metrics.observe('elasticsearch_request_seconds', expovariate(20))
+        metrics.increment('twitter_api_rate_limits_total', endpoint = 'search', key = i % 3)
+    with metrics.timer('example_seconds'):
+        sum(range(0, 100000))
+    print(metrics.to_prometheus())
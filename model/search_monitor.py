@@ -0,0 +1,91 @@
+'''
+Este script permite monitorizar búsquedas de tweets de forma incremental: cada vez que se
+repite una búsqueda, solo se consultan los tweets publicados desde la última vez que se
+realizó.
+'''
+
+import json
+from os import makedirs, replace
+from os.path import dirname, exists
+from threading import Lock
+
+from model.tweet import Tweet
+
+
+class SearchMonitor:
+    '''
+    Esta clase guarda, para cada búsqueda, la ID del tweet más reciente encontrado. Esta
+    información se almacena en un fichero, de forma que se mantiene entre distintas ejecuciones.
+    '''
+
+    # Fichero por defecto donde se guarda el estado de las búsquedas.
+    search_monitor_state_file = '../data/search_monitor.json'
+
+    def __init__(self, state_file = None, initial_count = 100):
+        '''
+        Inicializa la instancia.
+        :param state_file: Es la ruta del fichero donde se guarda el estado de las búsquedas. Por
+        defecto se usa search_monitor_state_file
+        :param initial_count: Número máximo de tweets a consultar la primera vez que se realiza
+        una búsqueda (cuando aún no se conoce ningún tweet de la misma)
+        '''
+        self.state_file = state_file if not state_file is None else self.search_monitor_state_file
+        self.initial_count = initial_count
+        self.lock = Lock()
+        self.state = {}
+        if exists(self.state_file):
+            with open(self.state_file, 'r') as state_file_handler:
+                self.state = json.load(state_file_handler)
+
+
+    def _save(self):
+        # Escribimos primero un fichero temporal para no corromper el estado si la escritura
+        # se interrumpe. El directorio se crea si no existe (de lo contrario se perderían los
+        # tweets ya consultados)
+        makedirs(dirname(self.state_file) or '.', exist_ok = True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as state_file_handler:
+            json.dump(self.state, state_file_handler)
+        replace(tmp_file, self.state_file)
+
+
+    def get_last_id(self, terms):
+        '''
+        :return: Devuelve la ID del tweet más reciente encontrado en la búsqueda indicada, o None
+        si la búsqueda aún no se ha realizado.
+        '''
+        with self.lock:
+            return self.state.get(terms)
+
+
+    def poll(self, terms):
+        '''
+        Realiza una búsqueda de tweets que mencionan los términos indicados.
+        :param terms: String con los términos a buscar
+        :return: Devuelve una lista con los tweets publicados desde la última vez que se realizó
+        esta misma búsqueda (del más reciente al más antiguo). La primera vez que se realiza la
+        búsqueda, se devuelven como máximo initial_count tweets.
+        '''
+        since_id = self.get_last_id(terms)
+        count = self.initial_count if since_id is None else None
+        tweets = list(Tweet.iter_search_by_terms(terms, count, since_id = since_id))
+
+        if len(tweets) > 0:
+            last_id = max([int(tweet.get_id()) for tweet in tweets])
+            with self.lock:
+                self.state[terms] = max(last_id, self.state.get(terms) or 0)
+                self._save()
+
+        return tweets
+
+
+    def reset(self, terms = None):
+        '''
+        Olvida el estado de una búsqueda (o de todas si no se indica ninguna).
+        '''
+        with self.lock:
+            if terms is None:
+                self.state.clear()
+            else:
+                self.state.pop(terms, None)
+            self._save()
@@ -1,13 +1,16 @@
 
 
-import requests
-from re import findall, match
 from datetime import datetime
 
+from model.link_extractor import default_link_extractor
+
 class Tweet(dict):
     '''
     Representa un post de un usuario en tweeter.
     '''
+    # Los atributos se guardan como claves del diccionario (no se reserva un __dict__ por instancia)
+    __slots__ = ()
+
     def __init__(self, author, id, text, post_type, num_retweets, timestamp, retweet_id = None, reply_id = None):
         '''
         Inicializa la instancia.
@@ -103,6 +106,14 @@ class Tweet(dict):
 
 
 
+    def get_links(self):
+        '''
+
+        :return: Devuelve las urls que aparecen en el cuerpo del mensaje
+        '''
+        return [link for link, host in default_link_extractor.extract(self.get_text())]
+
+
     def get_info_sources(self, follow_redirects=True, request_timeout=10):
         '''
         Obtiene los dominios de las fuentes externas mencionadas (hosts de las urls que aparecen
@@ -117,28 +128,42 @@ class Tweet(dict):
         se descarta.
         :return: Devuelve una lista de hosts de fuentes externas en el tweet.
         '''
+        return Tweet.get_info_sources_batch([self], follow_redirects, request_timeout)[0]
 
-        def follow_link(link):
-            result = requests.get(link, timeout=request_timeout)
-            return result.url
-
-        text = self.get_text()
-        links = [full_url for full_url, path_and_query in
-                 findall('(https?\:\/\/[^\/]+(\/[^ ]+)?)', text)]
-        source_links = []
-        for link in links:
-            try:
-                source_links.append(follow_link(link) if follow_redirects else link)
-            except Exception:
-                pass
-
-        # Ahora extraemos el host de la dirección
-        hosts = [match('^https?\:\/\/(www\.)?([^\/]+)(\/.*)?$', source_link).group(2) for source_link in source_links]
 
-        # Eliminamos hosts repetidos y tambien twitter.com y t.co
-        hosts = list(set(hosts) - set(['twitter.com', 't.co']))
-
-        return hosts
+    @staticmethod
+    def get_info_sources_batch(tweets, follow_redirects=True, request_timeout=10, resolver=None, extractor=None):
+        '''
+        Es igual que el método anterior, solo que obtiene las fuentes externas de varios tweets
+        a la vez. Las urls de todos los tweets se resuelven en paralelo.
+        :param tweets: Es un listado de tweets.
+        :param resolver: Es la instancia de la clase LinkResolver que se usará para seguir las
+        redirecciones. Por defecto se usa la instancia compartida (ver get_link_resolver). Las
+        estadísticas de throughput pueden consultarse con resolver.get_stats()
+        :param extractor: Es la instancia de la clase LinkExtractor que se usará para extraer las
+        urls y sus hosts (permite configurar los dominios excluidos). Por defecto se excluyen
+        twitter.com y t.co
+        :return: Devuelve una lista con los hosts de fuentes externas de cada tweet (en el
+        mismo orden que los tweets).
+        '''
+        if extractor is None:
+            extractor = default_link_extractor
+        links = extractor.extract_batch([tweet.get_text() for tweet in tweets])
+
+        if not follow_redirects:
+            # Eliminamos hosts repetidos y los de los dominios excluidos
+            return [list(dict.fromkeys(host for link, host in tweet_links if not host is None))
+                    for tweet_links in links]
+
+        if resolver is None:
+            resolver = get_link_resolver()
+        all_links = [link for tweet_links in links for link, host in tweet_links]
+        resolved = iter(resolver.resolve_many(all_links, request_timeout))
+        source_links = [[next(resolved) for link in tweet_links] for tweet_links in links]
+
+        # Ahora extraemos el host de la dirección final (descartamos las urls que no se pudieron
+        # resolver)
+        return [extractor.get_hosts(tweet_source_links) for tweet_source_links in source_links]
 
 
     @staticmethod
@@ -150,6 +175,26 @@ class Tweet(dict):
         '''
         return Twitter()._search_tweet_by_id(id)
 
+    @staticmethod
+    def search_by_id_async(id):
+        '''
+        Es igual que el método anterior, solo que no es bloqueante. Permite realizar varias
+        búsquedas en paralelo (una por cada clave de la API de twitter)
+        :return: Devuelve un objeto de la clase concurrent.futures.Future cuyo resultado es el
+        tweet, o None si no existe ningún tweet con esa ID.
+        '''
+        return Twitter()._search_tweet_by_id_async(id)
+
+    @staticmethod
+    def search_by_ids(ids):
+        '''
+        Busca varios tweets por ID. Se consultan hasta 100 tweets en cada petición a la API.
+        :param ids: Es un listado de IDs de tweets.
+        :return: Devuelve una lista con los tweets cuyas IDs son las indicadas (en el mismo orden).
+        Las posiciones de las IDs de tweets que no existen contendrán None.
+        '''
+        return Twitter()._search_tweets_by_ids(ids)
+
     @staticmethod
     def search_by_terms(terms, count = 10, publish_start_date = None, publish_end_date = None):
         '''
@@ -161,6 +206,17 @@ class Tweet(dict):
         '''
         return Twitter()._search_by_terms(terms, count, publish_start_date, publish_end_date)
 
+    @staticmethod
+    def iter_search_by_terms(terms, count = None, publish_start_date = None, publish_end_date = None, since_id = None):
+        '''
+        Es igual que el método anterior, solo que devuelve un generador que proporciona los tweets
+        a medida que se van consultando (página a página), sin necesidad de esperar a que finalice
+        la búsqueda. Puede dejar de iterarse en cualquier momento.
+        Si count es None, no se limita el número de tweets.
+        :param since_id: Si se especifica, solo se buscarán tweets cuya ID es mayor que esta.
+        '''
+        return Twitter()._iter_search_by_terms(terms, count, publish_start_date, publish_end_date, since_id)
+
 
     def __str__(self):
         s = 'Mensaje publicado por {} en la fecha {}:\n'.format(self.get_author(), datetime.fromtimestamp(float(self.get_timestamp())))
@@ -174,9 +230,10 @@ class Tweet(dict):
 
 
     def __hash__(self):
-        return hash(self.__repr__())
+        return hash(self.get_id())
 
     def __eq__(self, other):
         return isinstance(other, Tweet) and self.get_id() == other.get_id()
 
-from model.twitter_utils import Twitter
\ No newline at end of file
+from model.twitter_utils import Twitter
+from model.url_utils import get_link_resolver
\ No newline at end of file
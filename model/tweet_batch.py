@@ -0,0 +1,146 @@
+'''
+Este script define la clase TweetBatch, que permite almacenar una colección de tweets por
+columnas (un array por cada atributo), de forma compacta en memoria y adecuada para realizar
+análisis sobre todos los tweets a la vez (ver model.analytics)
+'''
+
+from array import array
+
+from model.tweet import Tweet
+from model.user import TwitterUser
+
+
+class TweetBatch:
+    '''
+    Colección de tweets almacenada por columnas.
+    Las IDs, timestamps, números de retweets y tipos de los tweets se guardan en arrays de enteros.
+    Los autores se guardan una sola vez (cada tweet guarda el índice de su autor)
+    '''
+
+    # Tipos de tweets. Cada tweet guarda el índice de su tipo en esta tupla.
+    post_types = ('original', 'retweet', 'reply')
+
+    def __init__(self, tweets = ()):
+        '''
+        Inicializa la instancia.
+        :param tweets: Tweets iniciales de la colección (opcional)
+        '''
+        self.ids = array('q')
+        self.timestamps = array('q')
+        self.num_retweets = array('q')
+        self.post_type_codes = array('b')
+        # Las IDs de los tweets retweeteados/respondidos son -1 si el tweet no es un
+        # retweet/respuesta
+        self.retweet_ids = array('q')
+        self.reply_ids = array('q')
+        self.texts = []
+
+        # Autores
+        self.author_indices = array('q')
+        self.author_names = []
+        self.author_num_followers = array('q')
+        self.author_num_friends = array('q')
+        self.author_index_by_name = {}
+
+        self.extend(tweets)
+
+
+    def _intern_author(self, author):
+        '''
+        Añade un autor a la colección (si no se había añadido previamente). Si ya existe, se
+        actualiza su número de seguidores y amigos.
+        :return: Devuelve el índice del autor.
+        '''
+        name = author.get_name()
+        index = self.author_index_by_name.get(name)
+        if index is None:
+            index = len(self.author_names)
+            self.author_index_by_name[name] = index
+            self.author_names.append(name)
+            self.author_num_followers.append(author.get_num_followers())
+            self.author_num_friends.append(author.get_num_friends())
+        else:
+            self.author_num_followers[index] = author.get_num_followers()
+            self.author_num_friends[index] = author.get_num_friends()
+        return index
+
+
+    def append(self, tweet):
+        '''
+        Añade un tweet a la colección.
+        '''
+        # Calculamos primero todos los valores, de forma que si el tweet no es válido no se
+        # añade nada (las columnas deben tener siempre la misma longitud)
+        retweet_id, reply_id = tweet.get_retweet_id(), tweet.get_reply_id()
+        id = int(tweet.get_id())
+        timestamp = int(tweet.get_timestamp())
+        num_retweets = int(tweet.get_num_retweets())
+        post_type_code = self.post_types.index(tweet.get_type())
+        retweet_id = int(retweet_id) if not retweet_id is None else -1
+        reply_id = int(reply_id) if not reply_id is None else -1
+        text = tweet.get_text()
+        author_index = self._intern_author(tweet.get_author())
+
+        self.ids.append(id)
+        self.timestamps.append(timestamp)
+        self.num_retweets.append(num_retweets)
+        self.post_type_codes.append(post_type_code)
+        self.retweet_ids.append(retweet_id)
+        self.reply_ids.append(reply_id)
+        self.texts.append(text)
+        self.author_indices.append(author_index)
+
+
+    def extend(self, tweets):
+        '''
+        Añade varios tweets a la colección.
+        '''
+        for tweet in tweets:
+            self.append(tweet)
+
+
+    def get_author(self, index):
+        '''
+        :return: Devuelve el autor cuyo índice es el indicado (una instancia de TwitterUser)
+        '''
+        return TwitterUser(self.author_names[index], self.author_num_followers[index], self.author_num_friends[index])
+
+
+    def get_num_authors(self):
+        '''
+        :return: Devuelve el número de autores distintos en la colección.
+        '''
+        return len(self.author_names)
+
+
+    def get_column(self, name):
+        '''
+        Devuelve una columna de la colección como un array de numpy (una copia).
+        :param name: Es el nombre de la columna: 'ids', 'timestamps', 'num_retweets',
+        'post_type_codes', 'retweet_ids', 'reply_ids', 'author_indices' (columnas de los tweets)
+        o 'author_num_followers', 'author_num_friends' (columnas de los autores)
+        '''
+        import numpy
+
+        if not name in ('ids', 'timestamps', 'num_retweets', 'post_type_codes', 'retweet_ids', 'reply_ids',
+                        'author_indices', 'author_num_followers', 'author_num_friends'):
+            raise ValueError('Columna desconocida: {}'.format(name))
+        column = getattr(self, name)
+        return numpy.array(column, dtype = column.typecode)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        post_type = self.post_types[self.post_type_codes[index]]
+        retweet_id = self.retweet_ids[index] if post_type == 'retweet' else None
+        reply_id = self.reply_ids[index] if post_type == 'reply' else None
+        return Tweet(self.get_author(self.author_indices[index]), str(self.ids[index]), self.texts[index],
+                     post_type, self.num_retweets[index], str(self.timestamps[index]),
+                     str(retweet_id) if not retweet_id is None else None,
+                     str(reply_id) if not reply_id is None else None)
+
+    def __iter__(self):
+        for index in range(0, len(self)):
+            yield self[index]
@@ -0,0 +1,228 @@
+'''
+Este script permite construir el grafo de propagación de los tweets: cada retweet o respuesta
+se une con el tweet retweeteado o respondido. Cada componente del grafo es un árbol (una
+cascada), cuya raíz es el tweet original.
+'''
+
+from array import array
+
+import numpy
+
+
+class CascadeGraph:
+    '''
+    Grafo de cascadas de retweets y respuestas.
+    Cada tweet se identifica internamente con un índice entero. Para cada índice se guarda, en
+    arrays de enteros, el índice de su padre (el tweet retweeteado o respondido), su raíz y su
+    profundidad. Los hijos de cada tweet se calculan bajo demanda en formato CSR (offsets +
+    índices de los hijos).
+    Los tweets pueden añadirse en cualquier orden: si se añade un tweet cuyo padre aún no se ha
+    añadido, el padre se crea como un nodo "desconocido" hasta que se añada.
+    '''
+
+    # Tipos de aristas (tipo de relación de cada tweet con su padre)
+    edge_types = (None, 'retweet', 'reply')
+
+    def __init__(self):
+        # Diccionario ID del tweet -> índice
+        self.index_by_id = {}
+        self.ids = array('q')
+        self.parents = array('q')
+        self.edge_type_codes = array('b')
+        self.known = array('b')
+        self.roots = array('q')
+        self.depths = array('q')
+        self.num_children = array('q')
+
+        # Se activa cuando se cambia el padre de un tweet que ya tiene hijos (sus raíces y
+        # profundidades deben recalcularse)
+        self.roots_outdated = False
+        # Hijos de cada tweet en formato CSR
+        self.children_offsets = None
+        self.children = None
+
+
+    def _get_index(self, id):
+        '''
+        :return: Devuelve el índice del tweet con la ID indicada. Si no existe, se crea.
+        '''
+        index = self.index_by_id.get(id)
+        if index is None:
+            index = len(self.ids)
+            self.index_by_id[id] = index
+            self.ids.append(id)
+            self.parents.append(-1)
+            self.edge_type_codes.append(0)
+            self.known.append(0)
+            self.roots.append(index)
+            self.depths.append(0)
+            self.num_children.append(0)
+        return index
+
+
+    def add(self, tweet):
+        '''
+        Añade un tweet al grafo.
+        '''
+        index = self._get_index(int(tweet.get_id()))
+        self.known[index] = 1
+
+        parent_id = tweet.get_retweet_id() if tweet.is_retweet() else (tweet.get_reply_id() if tweet.is_reply() else None)
+        if parent_id is None or self.parents[index] >= 0:
+            return
+        parent = self._get_index(int(parent_id))
+        if parent == index:
+            return
+
+        self.parents[index] = parent
+        self.edge_type_codes[index] = self.edge_types.index(tweet.get_type())
+        self.num_children[parent] += 1
+        self.children_offsets, self.children = None, None
+
+        if self.num_children[index] > 0:
+            self.roots_outdated = True
+        else:
+            self.roots[index] = self.roots[parent]
+            self.depths[index] = self.depths[parent] + 1
+
+
+    def add_many(self, tweets):
+        '''
+        Añade varios tweets al grafo (por ejemplo, a medida que se obtienen de
+        ElasticSearchCollector.iter_tweets)
+        '''
+        for tweet in tweets:
+            self.add(tweet)
+
+
+    def _update_roots(self):
+        '''
+        Recalcula la raíz y la profundidad de todos los tweets (pointer jumping)
+        '''
+        if not self.roots_outdated:
+            return
+        parents = numpy.array(self.parents, dtype = numpy.int64)
+        has_parent = parents >= 0
+        pointers = numpy.where(has_parent, parents, numpy.arange(len(parents)))
+        distances = has_parent.astype(numpy.int64)
+        while True:
+            next_pointers = pointers[pointers]
+            if numpy.array_equal(next_pointers, pointers):
+                break
+            distances = distances + distances[pointers]
+            pointers = next_pointers
+        self.roots = array('q', pointers.tobytes())
+        self.depths = array('q', distances.tobytes())
+        self.roots_outdated = False
+
+
+    def _update_children(self):
+        '''
+        Calcula los hijos de cada tweet en formato CSR.
+        '''
+        if not self.children is None:
+            return
+        parents = numpy.array(self.parents, dtype = numpy.int64)
+        counts = numpy.bincount(parents[parents >= 0], minlength = len(parents))
+        self.children_offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+        order = numpy.argsort(parents, kind = 'stable')
+        self.children = order[len(parents) - self.children_offsets[-1]:]
+
+
+    def _get_known_index(self, id):
+        index = self.index_by_id.get(int(id))
+        if index is None:
+            raise KeyError('El tweet {} no está en el grafo'.format(id))
+        return index
+
+
+    def is_known(self, id):
+        '''
+        :return: Devuelve True si el tweet se ha añadido al grafo, o False si solo se conoce
+        porque algún tweet añadido lo retweetea o responde.
+        '''
+        return bool(self.known[self._get_known_index(id)])
+
+
+    def get_parent(self, id):
+        '''
+        :return: Devuelve la ID del tweet retweeteado o respondido por el tweet indicado, o None
+        si es un tweet original.
+        '''
+        parent = self.parents[self._get_known_index(id)]
+        return self.ids[parent] if parent >= 0 else None
+
+
+    def get_root(self, id):
+        '''
+        :return: Devuelve la ID del tweet raíz de la cascada a la que pertenece el tweet indicado.
+        '''
+        self._update_roots()
+        return self.ids[self.roots[self._get_known_index(id)]]
+
+
+    def get_depth(self, id):
+        '''
+        :return: Devuelve la profundidad del tweet en su cascada (0 si es la raíz)
+        '''
+        self._update_roots()
+        return self.depths[self._get_known_index(id)]
+
+
+    def get_children(self, id):
+        '''
+        :return: Devuelve una lista con las IDs de los retweets y respuestas del tweet indicado.
+        '''
+        self._update_children()
+        index = self._get_known_index(id)
+        children = self.children[self.children_offsets[index]:self.children_offsets[index+1]]
+        return [self.ids[child] for child in children]
+
+
+    def get_cascade(self, id):
+        '''
+        :return: Devuelve una lista con las IDs de todos los tweets de la cascada que empieza en
+        el tweet indicado (el propio tweet y todos sus descendientes)
+        '''
+        self._update_children()
+        offsets, children = self.children_offsets, self.children
+        nodes = [self._get_known_index(id)]
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            nodes.extend(children[offsets[node]:offsets[node+1]].tolist())
+            i += 1
+        return [self.ids[node] for node in nodes]
+
+
+    def get_cascade_size(self, id):
+        '''
+        :return: Devuelve el número de tweets de la cascada que empieza en el tweet indicado.
+        '''
+        return len(self.get_cascade(id))
+
+
+    def get_cascades(self):
+        '''
+        Calcula el tamaño y la profundidad máxima de todas las cascadas del grafo.
+        :return: Devuelve una tupla de arrays de numpy (IDs de las raíces, tamaños, profundidades
+        máximas), ordenados por tamaño de mayor a menor.
+        '''
+        self._update_roots()
+        roots = numpy.array(self.roots, dtype = numpy.int64)
+        depths = numpy.array(self.depths, dtype = numpy.int64)
+        sizes = numpy.bincount(roots, minlength = len(roots))
+        max_depths = numpy.zeros(len(roots), dtype = numpy.int64)
+        numpy.maximum.at(max_depths, roots, depths)
+
+        root_indices = numpy.flatnonzero(roots == numpy.arange(len(roots)))
+        root_indices = root_indices[numpy.argsort(sizes[root_indices], kind = 'stable')[::-1]]
+        ids = numpy.array(self.ids, dtype = numpy.int64)
+        return ids[root_indices], sizes[root_indices], max_depths[root_indices]
+
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return int(id) in self.index_by_id
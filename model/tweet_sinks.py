@@ -0,0 +1,113 @@
+'''
+Este script define distintos destinos (sinks) donde pueden guardarse los tweets: ficheros
+JSON lines, ficheros Parquet y elasticsearch.
+Todos los sinks tienen los métodos write(tweets) y close()
+'''
+
+import json
+
+
+def tweet_to_row(tweet):
+    '''
+    Convierte un tweet en un diccionario "plano" (sin objetos anidados), donde los campos del
+    autor tienen el prefijo "author_"
+    '''
+    author = tweet.get_author()
+    return {
+        'id': tweet.get_id(),
+        'text': tweet.get_text(),
+        'post_type': tweet.get_type(),
+        'num_retweets': tweet.get_num_retweets(),
+        'timestamp': tweet.get_timestamp(),
+        'retweet_id': tweet.get_retweet_id(),
+        'reply_id': tweet.get_reply_id(),
+        'author_name': author.get_name(),
+        'author_num_followers': author.get_num_followers(),
+        'author_num_friends': author.get_num_friends()
+    }
+
+
+class JSONLinesSink:
+    '''
+    Guarda los tweets en un fichero de texto, un tweet por línea en formato JSON.
+    '''
+    def __init__(self, path, append = False):
+        self.file = open(path, 'a' if append else 'w', encoding = 'utf-8')
+
+    def write(self, tweets):
+        self.file.writelines([json.dumps(tweet, ensure_ascii = False) + '\n' for tweet in tweets])
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    '''
+    Guarda los tweets en un fichero Parquet (ver la función tweet_to_row). Requiere el paquete
+    pyarrow.
+    '''
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.string()),
+            ('text', pyarrow.string()),
+            ('post_type', pyarrow.string()),
+            ('num_retweets', pyarrow.int64()),
+            ('timestamp', pyarrow.string()),
+            ('retweet_id', pyarrow.string()),
+            ('reply_id', pyarrow.string()),
+            ('author_name', pyarrow.string()),
+            ('author_num_followers', pyarrow.int64()),
+            ('author_num_friends', pyarrow.int64())
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, tweets):
+        if len(tweets) == 0:
+            return
+        rows = [tweet_to_row(tweet) for tweet in tweets]
+        for row in rows:
+            for field in ('id', 'timestamp', 'retweet_id', 'reply_id'):
+                if not row[field] is None:
+                    row[field] = str(row[field])
+        columns = {name: [row[name] for row in rows] for name in self.schema.names}
+        self.writer.write_table(self.pyarrow.Table.from_pydict(columns, schema = self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ElasticSearchSink:
+    '''
+    Indexa los tweets en elasticsearch (índice "shokesu", tipo "posts"), con el mismo formato
+    que el resto de documentos del índice (ver model.elasticsearch_bulk.BulkWriter)
+    '''
+    def __init__(self, hosts = None, **kwargs):
+        '''
+        :param hosts: Es la lista de hosts de elasticsearch. Por defecto se usan los de
+        ElasticSearchCollector
+        :param kwargs: Parámetros adicionales del BulkWriter (e.g: max_batch_docs)
+        '''
+        from model.elasticsearch_bulk import BulkWriter
+        self.writer = BulkWriter(hosts = hosts, **kwargs)
+
+    def write(self, tweets):
+        self.writer.add_many(tweets)
+
+    def close(self):
+        self.writer.close()
+
+
+def open_sink(path, format = 'jsonl'):
+    '''
+    :param format: Es el formato del fichero: 'jsonl' o 'parquet'
+    :return: Devuelve un sink que guarda los tweets en el fichero indicado.
+    '''
+    if format == 'jsonl':
+        return JSONLinesSink(path)
+    if format == 'parquet':
+        return ParquetSink(path)
+    raise ValueError('Formato no soportado: {}'.format(format))
@@ -0,0 +1,300 @@
+'''
+Este script define un almacén local de tweets en disco. Los tweets (obtenidos de la API de
+twitter o de elasticsearch) se guardan en un fichero binario al que solo se añaden registros, y
+se indexan por ID y por timestamp, de forma que pueden consultarse sin volver a descargarlos.
+'''
+
+import mmap
+from array import array
+from bisect import bisect_left
+from os import replace
+from os.path import exists, getsize
+from struct import Struct
+from threading import RLock
+
+from model.tweet import Tweet
+from model.user import TwitterUser
+
+
+class TweetStore:
+    '''
+    Almacén de tweets en disco.
+    Cada tweet se guarda como un registro binario: una cabecera de tamaño fijo (ID, timestamp,
+    número de retweets, IDs del tweet retweeteado/respondido, tipo, seguidores y amigos del autor,
+    y longitud del nombre del autor), seguida del nombre del autor y el texto del tweet (UTF-8).
+    Los índices se guardan en un fichero aparte (con extensión .idx) al cerrar el almacén. Si
+    el fichero de índices no existe o está desactualizado, los registros que faltan se indexan
+    leyendo el fichero de datos.
+    Las IDs de los tweets deben ser numéricas.
+    '''
+
+    # Cabecera de cada registro: longitud de la parte variable, ID, timestamp, número de retweets,
+    # ID retweeteado, ID respondido, tipo, seguidores, amigos y longitud del nombre del autor
+    record_header = Struct('<IqqqqqbqqH')
+    # Cabecera del fichero de índices: tamaño del fichero de datos indexado y número de tweets
+    index_header = Struct('<QQ')
+
+    post_types = ('original', 'retweet', 'reply')
+
+    def __init__(self, path):
+        '''
+        Inicializa la instancia.
+        :param path: Es la ruta del fichero de datos (se crea si no existe)
+        '''
+        self.path = path
+        self.index_path = path + '.idx'
+        self.lock = RLock()
+        self.file = open(path, 'ab')
+        self.map = None
+        # Tamaño del fichero de datos (posición donde se escribirá el próximo registro)
+        self.size = 0
+
+        # Índice por ID: ID -> posición del registro en el fichero.
+        self.offsets_by_id = {}
+        # Índice por timestamp: timestamps, IDs y posiciones de los registros, ordenados por
+        # timestamp (los tweets añadidos desde la última ordenación se mantienen al final,
+        # desordenados)
+        self.timestamps = array('q')
+        self.timestamp_ids = array('q')
+        self.timestamp_offsets = array('q')
+        self.num_sorted = 0
+
+        self._load_index()
+
+
+    def _load_index(self):
+        '''
+        Carga los índices del fichero .idx e indexa los registros añadidos posteriormente.
+        '''
+        indexed_size = 0
+        if exists(self.index_path):
+            try:
+                with open(self.index_path, 'rb') as index_file:
+                    indexed_size, count = self.index_header.unpack(index_file.read(self.index_header.size))
+                    if indexed_size > getsize(self.path):
+                        # El fichero de índices no se corresponde con el fichero de datos.
+                        raise ValueError('Fichero de índices desactualizado')
+                    for column in (self.timestamps, self.timestamp_ids, self.timestamp_offsets):
+                        column.frombytes(index_file.read(count * 8))
+                        if len(column) != count:
+                            raise ValueError('Fichero de índices incompleto')
+                self.offsets_by_id = dict(zip(self.timestamp_ids, self.timestamp_offsets))
+                self.num_sorted = count
+            except Exception:
+                # El fichero de índices no es válido: indexamos de nuevo todos los registros.
+                indexed_size = 0
+                self.timestamps = array('q')
+                self.timestamp_ids = array('q')
+                self.timestamp_offsets = array('q')
+
+        # Indexamos el resto de registros.
+        offset = indexed_size
+        data = self._get_map()
+        while not data is None and offset + self.record_header.size <= len(data):
+            header = self.record_header.unpack_from(data, offset)
+            record_size = self.record_header.size + header[0]
+            if offset + record_size > len(data):
+                break
+            self._index(header[1], header[2], offset)
+            offset += record_size
+
+        if offset < getsize(self.path):
+            # El último registro está incompleto (la escritura se interrumpió). Lo descartamos.
+            if not self.map is None:
+                self.map.close()
+                self.map = None
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.size = offset
+
+
+    def _index(self, id, timestamp, offset):
+        self.offsets_by_id[id] = offset
+        self.timestamps.append(timestamp)
+        self.timestamp_ids.append(id)
+        self.timestamp_offsets.append(offset)
+
+
+    def _get_map(self):
+        '''
+        :return: Devuelve el fichero de datos mapeado en memoria (None si está vacío). Si el
+        fichero ha crecido desde que se mapeó, se vuelve a mapear.
+        '''
+        self.file.flush()
+        size = getsize(self.path)
+        if size == 0:
+            return None
+        if self.map is None or len(self.map) < size:
+            if not self.map is None:
+                self.map.close()
+            with open(self.path, 'rb') as data_file:
+                self.map = mmap.mmap(data_file.fileno(), 0, access = mmap.ACCESS_READ)
+        return self.map
+
+
+    def _sort_timestamp_index(self):
+        if self.num_sorted == len(self.timestamps):
+            return
+        order = sorted(range(0, len(self.timestamps)), key = self.timestamps.__getitem__)
+        self.timestamps = array('q', [self.timestamps[i] for i in order])
+        self.timestamp_ids = array('q', [self.timestamp_ids[i] for i in order])
+        self.timestamp_offsets = array('q', [self.timestamp_offsets[i] for i in order])
+        self.num_sorted = len(self.timestamps)
+
+
+    def _read(self, offset):
+        '''
+        Lee el tweet cuyo registro empieza en la posición indicada.
+        '''
+        data = self.map
+        if data is None or offset >= len(data):
+            data = self._get_map()
+        (size, id, timestamp, num_retweets, retweet_id, reply_id, post_type_code,
+         num_followers, num_friends, name_size) = self.record_header.unpack_from(data, offset)
+        start = offset + self.record_header.size
+        name = data[start:start+name_size].decode('utf-8')
+        text = data[start+name_size:start+size].decode('utf-8')
+
+        post_type = self.post_types[post_type_code]
+        author = TwitterUser(name, num_followers, num_friends)
+        return Tweet(author, str(id), text, post_type, num_retweets, str(timestamp),
+                     str(retweet_id) if post_type == 'retweet' and retweet_id >= 0 else None,
+                     str(reply_id) if post_type == 'reply' and reply_id >= 0 else None)
+
+
+    def add(self, tweet):
+        '''
+        Añade un tweet al almacén. Si ya existe un tweet con la misma ID, no se añade.
+        :return: Devuelve True si el tweet se añadió, False en caso contrario.
+        '''
+        id = int(tweet.get_id())
+        retweet_id, reply_id = tweet.get_retweet_id(), tweet.get_reply_id()
+        author = tweet.get_author()
+        name = author.get_name().encode('utf-8')
+        text = tweet.get_text().encode('utf-8')
+        timestamp = int(tweet.get_timestamp())
+        header = self.record_header.pack(len(name) + len(text), id, timestamp, tweet.get_num_retweets(),
+                                         int(retweet_id) if not retweet_id is None else -1,
+                                         int(reply_id) if not reply_id is None else -1,
+                                         self.post_types.index(tweet.get_type()),
+                                         author.get_num_followers(), author.get_num_friends(), len(name))
+        with self.lock:
+            if id in self.offsets_by_id:
+                return False
+            offset = self.size
+            self.file.write(header + name + text)
+            self.size += len(header) + len(name) + len(text)
+            self._index(id, timestamp, offset)
+        return True
+
+
+    def add_many(self, tweets):
+        '''
+        Añade varios tweets al almacén (por ejemplo, los obtenidos con
+        ElasticSearchCollector.iter_tweets o Tweet.search_by_terms)
+        :return: Devuelve el número de tweets añadidos.
+        '''
+        return sum([1 for tweet in tweets if self.add(tweet)])
+
+
+    def get(self, id):
+        '''
+        :return: Devuelve el tweet cuya ID es la indicada, o None si no está en el almacén.
+        '''
+        with self.lock:
+            offset = self.offsets_by_id.get(int(id))
+            if offset is None:
+                return None
+            return self._read(offset)
+
+
+    def scan_time_range(self, start_timestamp = None, end_timestamp = None):
+        '''
+        Devuelve los tweets publicados en el intervalo de tiempo indicado, ordenados por timestamp.
+        :param start_timestamp: Timestamp UNIX de inicio del intervalo (incluido). Si es None, no
+        se limita el inicio.
+        :param end_timestamp: Timestamp UNIX de fin del intervalo (excluido). Si es None, no se
+        limita el fin.
+        :return: Devuelve una lista de tweets.
+        '''
+        with self.lock:
+            self._sort_timestamp_index()
+            start = bisect_left(self.timestamps, start_timestamp) if not start_timestamp is None else 0
+            end = bisect_left(self.timestamps, end_timestamp) if not end_timestamp is None else len(self.timestamps)
+            return [self._read(self.timestamp_offsets[i]) for i in range(start, end)]
+
+
+    def search_by_id(self, id):
+        '''
+        Busca un tweet en el almacén. Si no está, se busca con la API de twitter y se añade al
+        almacén.
+        :return: Devuelve el tweet cuya ID es la indicada, o None si no existe.
+        '''
+        tweet = self.get(id)
+        if tweet is None:
+            tweet = Tweet.search_by_id(id)
+            if not tweet is None:
+                self.add(tweet)
+        return tweet
+
+
+    def search_by_ids(self, ids):
+        '''
+        Es igual que el método anterior, solo que busca varios tweets. Los que no están en el
+        almacén se buscan con la API de twitter en peticiones por lotes.
+        :return: Devuelve una lista con los tweets (en el mismo orden que las IDs), con None en
+        las posiciones de los tweets que no existen.
+        '''
+        tweets = [self.get(id) for id in ids]
+        missing_ids = [id for id, tweet in zip(ids, tweets) if tweet is None]
+        if len(missing_ids) > 0:
+            found = {}
+            for tweet in Tweet.search_by_ids(missing_ids):
+                if not tweet is None:
+                    self.add(tweet)
+                    found[int(tweet.get_id())] = tweet
+            tweets = [tweet if not tweet is None else found.get(int(id)) for id, tweet in zip(ids, tweets)]
+        return tweets
+
+
+    def flush(self):
+        '''
+        Escribe en disco los tweets añadidos y los índices.
+        '''
+        with self.lock:
+            self.file.flush()
+            self._sort_timestamp_index()
+            # Escribimos primero un fichero temporal para no corromper los índices si la escritura
+            # se interrumpe.
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'wb') as index_file:
+                index_file.write(self.index_header.pack(self.size, len(self.timestamps)))
+                index_file.write(self.timestamps.tobytes())
+                index_file.write(self.timestamp_ids.tobytes())
+                index_file.write(self.timestamp_offsets.tobytes())
+            replace(tmp_path, self.index_path)
+
+
+    def close(self):
+        '''
+        Guarda los índices y cierra el almacén.
+        '''
+        with self.lock:
+            self.flush()
+            if not self.map is None:
+                self.map.close()
+                self.map = None
+            self.file.close()
+
+
+    def __len__(self):
+        return len(self.offsets_by_id)
+
+    def __contains__(self, id):
+        return int(id) in self.offsets_by_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
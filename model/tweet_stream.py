@@ -0,0 +1,287 @@
+'''
+Este script permite recibir en tiempo real los tweets que mencionan alguno de los términos
+indicados (API de streaming de twitter, endpoint statuses/filter), en lugar de consultarlos
+periódicamente con Tweet.search_by_terms (lo que consume el rate limit de la API y pierde
+tweets cuando hay picos de actividad).
+Los tweets recibidos se encolan en una cola de tamaño limitado y se escriben por lotes, desde
+otro hilo, en uno o varios sinks (ver model.tweet_sinks). Si los sinks no dan abasto y la cola
+se llena, la recepción se bloquea hasta que haya sitio (o se descartan los tweets nuevos, ver
+TweetStream)
+e.g:
+with TweetStream([JSONLinesSink('tweets.jsonl'), ElasticSearchSink()]) as stream:
+    stream.filter(['@sanchezcastejon', '@marianorajoy'], record_path = 'statuses.jsonl')
+    sleep(3600)
+
+Los mensajes recibidos pueden grabarse (record_path) y reproducirse después sin conexión con
+el método replay.
+'''
+
+import json
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from time import sleep, time
+
+from model.metrics import get_metrics
+
+
+class TweetStream:
+    '''
+    Pipeline de ingestión de tweets en tiempo real.
+    '''
+
+    # Marca el final de la cola (ver el método stop)
+    _end = object()
+
+    def __init__(self, sinks, max_queue_size = 10000, batch_size = 100, flush_interval = 1.0, drop_when_full = False):
+        '''
+        Inicializa la instancia.
+        :param sinks: Lista de sinks donde se escriben los tweets (objetos con los métodos
+        write(tweets) y close())
+        :param max_queue_size: Número máximo de tweets en la cola (pendientes de escribirse)
+        :param batch_size: Número de tweets que se escriben a la vez en los sinks.
+        :param flush_interval: Tiempo máximo (en segundos) que un tweet permanece en la cola
+        antes de escribirse (aunque el lote no esté completo)
+        :param drop_when_full: Si es False, cuando la cola está llena la recepción se bloquea
+        hasta que haya sitio (twitter cierra la conexión si el cliente no lee los mensajes durante
+        demasiado tiempo). Si es True, los tweets que no caben en la cola se descartan.
+        '''
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_when_full = drop_when_full
+        self.queue = Queue(maxsize = max_queue_size)
+        self.thread = None
+        self.stream = None
+        self.record_file = None
+        self.lock = Lock()
+
+        # Estadísticas
+        self.num_received = 0
+        self.num_invalid = 0
+        self.num_dropped = 0
+        self.num_written = 0
+        self.num_sink_failures = 0
+
+
+    def start(self):
+        '''
+        Inicia el hilo que escribe los tweets en los sinks (si no se había iniciado ya)
+        '''
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target = self._consume, daemon = True)
+                self.thread.start()
+
+
+    def put(self, tweet):
+        '''
+        Encola un tweet para que se escriba en los sinks.
+        :return: Devuelve False si el tweet se descartó (la cola está llena y drop_when_full es
+        True), True en caso contrario.
+        '''
+        self.start()
+        metrics = get_metrics()
+        with self.lock:
+            self.num_received += 1
+        try:
+            if self.drop_when_full:
+                self.queue.put_nowait(tweet)
+            else:
+                self.queue.put(tweet)
+        except Full:
+            with self.lock:
+                self.num_dropped += 1
+            metrics.increment('stream_tweets_dropped_total')
+            return False
+        metrics.increment('stream_tweets_received_total')
+        return True
+
+
+    def put_status(self, status):
+        '''
+        Igual que el método anterior, solo que recibe un tweet de la API de twitter (una
+        instancia de tweepy.Status), que se convierte en una instancia de Tweet.
+        :return: Devuelve True si el tweet se encoló.
+        '''
+        tweet = Twitter()._process_tweet(status)
+        if tweet is None:
+            with self.lock:
+                self.num_invalid += 1
+            return False
+        return self.put(tweet)
+
+
+    def _consume(self):
+        '''
+        Escribe en los sinks los tweets de la cola, por lotes. Se ejecuta en un hilo aparte.
+        '''
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(deadline - time(), 0) if not deadline is None else None
+            try:
+                tweet = self.queue.get(timeout = timeout)
+            except Empty:
+                tweet = None
+            if tweet is self._end:
+                self._write(batch)
+                return
+            if not tweet is None:
+                if len(batch) == 0:
+                    deadline = time() + self.flush_interval
+                batch.append(tweet)
+            if len(batch) >= self.batch_size or (not deadline is None and time() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+
+    def _write(self, batch):
+        if len(batch) == 0:
+            return
+        metrics = get_metrics()
+        for sink in self.sinks:
+            try:
+                with metrics.timer('stream_sink_write_seconds', sink = type(sink).__name__):
+                    sink.write(batch)
+            except Exception:
+                # Un sink que falla no debe detener al resto.
+                metrics.increment('stream_sink_failures_total', sink = type(sink).__name__)
+                with self.lock:
+                    self.num_sink_failures += 1
+        with self.lock:
+            self.num_written += len(batch)
+
+
+    def filter(self, terms, languages = None, record_path = None):
+        '''
+        Se conecta a la API de streaming de twitter y empieza a recibir (en segundo plano) los
+        tweets que mencionan alguno de los términos indicados. Se usa la primera clave de la API
+        (ver TwitterAPIPool)
+        :param terms: Lista de términos a buscar.
+        :param languages: Lista opcional de idiomas de los tweets (e.g: ['es'])
+        :param record_path: Si se especifica, los mensajes recibidos se guardan en este fichero
+        (uno por línea, en formato JSON), de forma que pueden reproducirse después con el
+        método replay.
+        '''
+        import tweepy
+
+        pipeline = self
+
+        class Listener(tweepy.StreamListener):
+            def on_data(self, raw_data):
+                # El fichero puede cerrarse (ver el método stop) mientras el hilo de tweepy sigue
+                # recibiendo mensajes.
+                with pipeline.lock:
+                    if not pipeline.record_file is None:
+                        pipeline.record_file.write(raw_data.strip() + '\n')
+                return super().on_data(raw_data)
+
+            def on_status(self, status):
+                pipeline.put_status(status)
+                return True
+
+            def on_error(self, status_code):
+                get_metrics().increment('stream_errors_total', status = status_code)
+                # Seguimos conectados: tweepy vuelve a conectarse esperando cada vez más tiempo
+                # (también tras el error 420, que indica que nos estamos reconectando demasiado)
+                return True
+
+        self.start()
+        if not record_path is None:
+            self.record_file = open(record_path, 'a', encoding = 'utf-8')
+        self.stream = tweepy.Stream(Twitter().api.get_auth(), Listener())
+        self.stream.filter(track = list(terms), languages = languages, is_async = True)
+
+
+    def replay(self, path, rate = None):
+        '''
+        Reproduce los mensajes grabados con el método filter (o cualquier fichero con un tweet de
+        la API de twitter en formato JSON en cada línea), como si se estuvieran recibiendo de la
+        API de streaming. Los mensajes que no son tweets (e.g: avisos de borrado o de límite)
+        se ignoran.
+        :param rate: Número máximo de tweets por segundo. Si es None, los tweets se encolan tan
+        rápido como lo permitan los sinks.
+        :return: Devuelve el número de tweets encolados.
+        '''
+        from tweepy.models import Status
+
+        self.start()
+        num_tweets = 0
+        start_time = time()
+        with open(path, 'r', encoding = 'utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if not 'in_reply_to_status_id' in data:
+                    continue
+                if not rate is None:
+                    delay = start_time + num_tweets / rate - time()
+                    if delay > 0:
+                        sleep(delay)
+                if self.put_status(Status.parse(None, data)):
+                    num_tweets += 1
+        return num_tweets
+
+
+    def stop(self, close_sinks = True):
+        '''
+        Se desconecta de la API de streaming (si estaba conectado), escribe los tweets pendientes
+        y espera a que finalice el hilo que los escribe.
+        :param close_sinks: Si es True, se cierran los sinks.
+        '''
+        if not self.stream is None:
+            self.stream.disconnect()
+            self.stream = None
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if not thread is None:
+            self.queue.put(self._end)
+            thread.join()
+        with self.lock:
+            if not self.record_file is None:
+                self.record_file.close()
+                self.record_file = None
+        if close_sinks:
+            for sink in self.sinks:
+                sink.close()
+
+
+    def get_stats(self):
+        '''
+        :return: Devuelve un diccionario con el número de tweets recibidos, descartados por no
+        ser válidos, descartados por estar la cola llena, escritos y pendientes, y el número de
+        errores de escritura en los sinks.
+        '''
+        with self.lock:
+            return {
+                'num_received': self.num_received,
+                'num_invalid': self.num_invalid,
+                'num_dropped': self.num_dropped,
+                'num_written': self.num_written,
+                'num_pending': self.queue.qsize(),
+                'num_sink_failures': self.num_sink_failures
+            }
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+from model.twitter_utils import Twitter
+
+
+if __name__ == '__main__':
+    # e.g: python -m model.tweet_stream statuses.jsonl tweets.jsonl
+    import sys
+    from model.tweet_sinks import JSONLinesSink
+
+    with TweetStream([JSONLinesSink(sys.argv[2])]) as stream:
+        start_time = time()
+        stream.replay(sys.argv[1])
+    print('{} ({:.2f}s)'.format(stream.get_stats(), time() - start_time))
@@ -2,40 +2,226 @@
 Este script tiene como objetivo facilitar el acceso a la API de twiteer mediante
 la creación de varias claves (API keys). De esta forma, se pueden realizar consultas
 con mayor frecuencia (debido a los limit rates)
+El módulo tweepy se importa, y los objetos API de cada clave se crean, la primera vez que se
+usan (importar este módulo o crear el pool no tiene coste)
 '''
 
-import tweepy
 import json
-from tweepy import OAuthHandler
-from time import sleep
+import os
+from time import sleep, time
+from threading import Lock, Condition
+from concurrent.futures import ThreadPoolExecutor
+
+from model.metrics import get_metrics
+
+
+def endpoint(name):
+    '''
+    Decorador que permite indicar a qué endpoint de la API de twitter accede un callback que se
+    pasa al método TwitterAPIPool.execute (para llevar la cuenta de sus rate limits).
+    e.g:
+    @endpoint('search')
+    def request(api):
+        return api.search(q = 'hola')
+    '''
+    def decorator(f):
+        f.endpoint = name
+        return f
+    return decorator
+
+
+class RateLimitScheduler:
+    '''
+    Lleva la cuenta de las peticiones restantes de cada clave de la API de twitter en cada
+    endpoint, y el instante en el que se restablecen (a partir de las cabeceras
+    x-rate-limit-remaining y x-rate-limit-reset de las respuestas)
+    '''
+
+    # Duración (en segundos) de la ventana de rate limit de twitter. Se usa cuando se agota
+    # el límite de una clave pero la respuesta no indica cuando se restablece.
+    rate_limit_window = 15 * 60
+
+    def __init__(self, num_keys, max_requests_per_key = 1):
+        '''
+        Inicializa la instancia.
+        :param num_keys: Es el número de claves.
+        :param max_requests_per_key: Es el número máximo de peticiones que pueden estar en curso
+        a la vez con una misma clave.
+        '''
+        self.num_keys = num_keys
+        self.max_requests_per_key = max_requests_per_key
+        # Diccionario (índice de la clave, endpoint) -> (peticiones restantes, instante de reset)
+        self.limits = {}
+        # Número de peticiones en curso con cada clave.
+        self.requests_in_progress = [0] * num_keys
+        self.condition = Condition()
+
+
+    def select(self, endpoint, excluded_keys = ()):
+        '''
+        Selecciona la clave con más peticiones restantes para el endpoint indicado. Las claves
+        de las que aún no se conoce su límite se consideran con peticiones disponibles. Las claves
+        que tienen el número máximo de peticiones en curso no se seleccionan.
+        :param excluded_keys: Índices de las claves que no deben seleccionarse.
+        :return: Devuelve una tupla (índice de la clave, tiempo de espera). Si hay alguna clave
+        disponible, el tiempo de espera es None. En caso contrario, el índice es None y el tiempo
+        de espera indica los segundos que faltan hasta que se restablezca la primera de ellas
+        (será 0 si alguna clave está ocupada, y None si todas las claves están excluidas)
+        '''
+        now = time()
+        best_index, best_remaining = None, 0
+        earliest_reset = None
+        for index in range(0, self.num_keys):
+            if index in excluded_keys:
+                continue
+            if self.requests_in_progress[index] >= self.max_requests_per_key:
+                earliest_reset = now
+                continue
+            remaining, reset = self.limits.get((index, endpoint), (None, None))
+            if remaining is None or reset <= now:
+                remaining = float('inf')
+            if remaining > best_remaining:
+                best_index, best_remaining = index, remaining
+            elif remaining == 0 and (earliest_reset is None or reset < earliest_reset):
+                earliest_reset = reset
+
+        if not best_index is None:
+            return best_index, None
+        if earliest_reset is None:
+            return None, None
+        return None, max(earliest_reset - now, 0)
+
+
+    def acquire(self, endpoint, excluded_keys = ()):
+        '''
+        Selecciona una clave (ver el método select) y la marca como ocupada. Si no hay ninguna
+        clave disponible, el método se bloquea hasta que se libere alguna o se restablezca su
+        límite.
+        :return: Devuelve el índice de la clave seleccionada, o None si todas las claves están
+        excluidas. Una vez realizada la petición, debe invocarse el método release.
+        '''
+        with self.condition:
+            while True:
+                index, wait_time = self.select(endpoint, excluded_keys)
+                if not index is None:
+                    self.requests_in_progress[index] += 1
+                    return index
+                if wait_time is None:
+                    return None
+                if wait_time > 0:
+                    # Esperamos hasta que se restablezca el límite de alguna clave.
+                    get_metrics().increment('twitter_api_rate_limit_stalls_total', endpoint = endpoint)
+                    self.condition.wait(wait_time + 1)
+                else:
+                    # Esperamos hasta que se libere alguna clave.
+                    self.condition.wait()
+
+
+    def release(self, index):
+        '''
+        Libera una clave seleccionada previamente con el método acquire.
+        '''
+        with self.condition:
+            self.requests_in_progress[index] -= 1
+            self.condition.notify_all()
+
+
+    def update(self, index, endpoint, response):
+        '''
+        Actualiza el límite de una clave en un endpoint a partir de las cabeceras de una
+        respuesta HTTP de la API.
+        :param response: Es la respuesta HTTP (puede ser None)
+        '''
+        try:
+            headers = response.headers
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return
+        with self.condition:
+            self.limits[(index, endpoint)] = (remaining, reset)
+
+
+    def exhaust(self, index, endpoint, response = None):
+        '''
+        Indica que se ha agotado el límite de una clave en un endpoint.
+        :param response: Es la respuesta HTTP de la API (puede ser None). Si contiene el
+        instante de reset, se usará. En caso contrario, se supondrá que el límite se restablece
+        una vez transcurrida la ventana de rate limit.
+        '''
+        get_metrics().increment('twitter_api_rate_limits_total', endpoint = endpoint, key = index)
+        self.update(index, endpoint, response)
+        with self.condition:
+            remaining, reset = self.limits.get((index, endpoint), (0, None))
+            if remaining > 0 or reset is None or reset <= time():
+                reset = time() + self.rate_limit_window
+            self.limits[(index, endpoint)] = (0, reset)
 
 
 class TwitterAPIPool:
-    # Fichero con las claves usar de la API de twitter
+    # Fichero con las claves usar de la API de twitter. Puede indicarse otro fichero con la
+    # variable de entorno TWITTER_API_KEYS_FILE, o al crear el pool.
     twitter_api_keys_file = '../data/tweet_keys.json'
+    keys_file_env_var = 'TWITTER_API_KEYS_FILE'
+
+    # Campos de cada clave
+    key_fields = ('consumer_key', 'consumer_secret', 'access_token', 'access_token_secret')
+
+    # Códigos de error de la API que indican que el objeto consultado no existe o no es accesible
+    # (e.g: 144 = No status found with that ID, 50 = User not found, 63 = User has been
+    # suspended). Las peticiones que fallan con estos errores no se reintentan.
+    permanent_error_codes = (17, 34, 50, 63, 144, 179)
 
     '''
     Esta clase representa un conjunto de objetos de la clase tweepy.API que pueden usarse
     para lanzar consultas a la API de tweeter.
     Usa el patrón singleton.
+    Es seguro usar una misma instancia desde varios hilos.
     '''
-    def __init__(self):
-        self.apis = []
+    def __init__(self, max_requests_per_key = 1, keys_file = None, max_retries = 3, max_retry_time = 30 * 60):
+        '''
+        Inicializa la instancia.
+        :param max_requests_per_key: Número máximo de peticiones en curso a la vez con cada clave.
+        :param keys_file: Fichero con las claves de la API de twitter (una clave en formato JSON
+        en cada línea). Por defecto se usa el indicado en la variable de entorno
+        TWITTER_API_KEYS_FILE, o si no existe, twitter_api_keys_file
+        :param max_retries: Número máximo de veces que se reintenta una petición después de que
+        haya fallado con todas las claves (por errores temporales: errores 5xx o de red)
+        :param max_retry_time: Tiempo máximo (en segundos) durante el que se reintenta una
+        petición (incluyendo las esperas por rate limits). Si es None, no hay límite.
+        '''
+        if keys_file is None:
+            keys_file = os.environ.get(self.keys_file_env_var, self.twitter_api_keys_file)
         # Leemos las claves de la API de twitter disponibles.
-        with open(self.twitter_api_keys_file, 'r') as twitter_api_keys_file_handler:
-            keys = [json.loads(line) for line in twitter_api_keys_file_handler.read().splitlines()]
-        for key in keys:
-            try:
-                # Creamos un objeto API con cada clave
-                auth = OAuthHandler(key['consumer_key'], key['consumer_secret'])
-                auth.set_access_token(key['access_token'], key['access_token_secret'])
-                api = tweepy.API(auth_handler=auth)
-                self.apis.append(api)
-            except:
-                # Descartamos aquellas claves incorrectas o inválidas.
-                pass
-        if len(self.apis) > 0:
-            self.last_api_selected_index = None
+        with open(keys_file, 'r') as twitter_api_keys_file_handler:
+            keys = [json.loads(line) for line in twitter_api_keys_file_handler.read().splitlines() if line.strip()]
+        # Descartamos aquellas claves incorrectas o inválidas.
+        self.keys = [key for key in keys if isinstance(key, dict) and
+                     all([not key.get(field) is None for field in self.key_fields])]
+        # Los objetos API de cada clave se crean la primera vez que se usan (ver _get_api)
+        self.apis = [None] * len(self.keys)
+        self.last_api_selected_index = None
+        self.lock = Lock()
+        self.scheduler = RateLimitScheduler(len(self.apis), max_requests_per_key)
+        self.executor = None
+        self.max_retries = max_retries
+        self.max_retry_time = max_retry_time
+
+
+    def is_permanent_error(self, error):
+        '''
+        :param error: Es una excepción de la clase tweepy.TweepError
+        :return: Devuelve True si el error no es temporal, es decir, si no tiene sentido reintentar
+        la petición (ni con otra clave): el objeto consultado no existe o no es accesible, o la
+        petición no es válida (errores HTTP 4xx, salvo el 429 y el 401, que depende de la clave)
+        '''
+        import tweepy
+        if isinstance(error, tweepy.RateLimitError):
+            return False
+        if getattr(error, 'api_code', None) in self.permanent_error_codes:
+            return True
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+        return isinstance(status_code, int) and 400 <= status_code < 500 and not status_code in (401, 429)
 
 
     def get_api(self):
@@ -48,12 +234,38 @@ class TwitterAPIPool:
             return None
 
         # Seleccionamos el siguiente objeto API
-        api_index = self.last_api_selected_index + 1 if not self.last_api_selected_index is None else 0
-        if api_index == len(self.apis):
-            api_index = 0
-        api = self.apis[api_index]
-        self.last_api_selected_index = api_index
+        with self.lock:
+            api_index = self.last_api_selected_index + 1 if not self.last_api_selected_index is None else 0
+            if api_index == len(self.apis):
+                api_index = 0
+            self.last_api_selected_index = api_index
+
+        return self._get_api(api_index)
+
 
+    def get_auth(self, index = 0):
+        '''
+        :return: Devuelve el objeto de autenticación (tweepy.OAuthHandler) de la clave indicada
+        (e.g: para conectarse a la API de streaming)
+        '''
+        return self._get_api(index).auth
+
+
+    def _get_api(self, index):
+        '''
+        :return: Devuelve el objeto tweepy.API de la clave indicada (se crea la primera vez)
+        '''
+        api = self.apis[index]
+        if api is None:
+            import tweepy
+            with self.lock:
+                api = self.apis[index]
+                if api is None:
+                    key = self.keys[index]
+                    auth = tweepy.OAuthHandler(key['consumer_key'], key['consumer_secret'])
+                    auth.set_access_token(key['access_token'], key['access_token_secret'])
+                    api = tweepy.API(auth_handler=auth)
+                    self.apis[index] = api
         return api
 
 
@@ -74,30 +286,82 @@ class TwitterAPIPool:
             return api.followers(user_id)
         followers = Tweeter().execute(request, user_id = 1)
 
+        Cada petición se envía con la clave que tenga más peticiones restantes en el endpoint
+        correspondiente (ver RateLimitScheduler). El endpoint es el nombre del método de la API,
+        o en el caso de los callbacks, el indicado con el decorador endpoint (o el nombre del
+        callback si no se usó el decorador)
         '''
+        if len(self.apis) == 0:
+            raise Exception('No hay ninguna clave válida de la API de twitter')
+        import tweepy
 
-        # El método es bloqueante, hasta que no se obtiene una respuesta correcta
-        # con algún objeto API (sin que lanze excepciones del tipo, RateLimitError o
-        # TweepError), el método no finalizará.
+        endpoint_name = getattr(f, 'endpoint', f.__name__) if callable(f) else f
+
+        # El método es bloqueante: los rate limits y los errores temporales se reintentan (con
+        # otra clave) hasta obtener una respuesta correcta, o hasta superar el número máximo de
+        # reintentos o max_retry_time. En tal caso, se genera el último error obtenido. Los
+        # errores permanentes (ver is_permanent_error) se generan inmediatamente.
+        metrics = get_metrics()
+        deadline = time() + self.max_retry_time if not self.max_retry_time is None else None
+        failed_keys = set()
+        num_retries = 0
+        last_error = None
         while True:
-            # Probamos con cada objeto API
-            for index in range(0, len(self.apis)):
-                api = self.get_api()
-                try:
-                    # Invocamos el método API con el objeto seleccionado
+            # Tiempo de espera hasta que hay una clave disponible (incluye las esperas por rate
+            # limits) y tiempo de la petición, por separado.
+            with metrics.timer('twitter_api_wait_seconds', endpoint = endpoint_name):
+                index = self.scheduler.acquire(endpoint_name, failed_keys)
+            if index is None:
+                # Todas las claves han fallado por errores distintos a los rate limits.
+                num_retries += 1
+                if num_retries > self.max_retries or (not deadline is None and time() + 15 > deadline):
+                    raise last_error
+                sleep(15)
+                failed_keys.clear()
+                continue
+
+            api = self._get_api(index)
+            try:
+                # Invocamos el método API con el objeto seleccionado
+                with metrics.timer('twitter_api_request_seconds', endpoint = endpoint_name):
                     if callable(f):
                         func = f
                         result = func(api, *args, **kwargs)
                     else:
                         func = getattr(api, f)
                         result = func(*args, **kwargs)
-                    # El método ha finalizado correctamente, devolvemos el resultaod.
-                    return result
-                except tweepy.RateLimitError:
-                    pass
-                except tweepy.TweepError:
-                    pass
-            sleep(15)
+                self.scheduler.update(index, endpoint_name, getattr(api, 'last_response', None))
+                # El método ha finalizado correctamente, devolvemos el resultaod.
+                return result
+            except tweepy.RateLimitError as e:
+                self.scheduler.exhaust(index, endpoint_name, e.response)
+                last_error = e
+            except tweepy.TweepError as e:
+                metrics.increment('twitter_api_errors_total', endpoint = endpoint_name, key = index)
+                self.scheduler.update(index, endpoint_name, e.response)
+                if self.is_permanent_error(e):
+                    raise
+                failed_keys.add(index)
+                last_error = e
+            finally:
+                self.scheduler.release(index)
+            if not deadline is None and time() >= deadline:
+                raise last_error
+
+
+    def submit(self, f, *args, **kwargs):
+        '''
+        Es igual que el método execute, solo que no es bloqueante: la petición se ejecuta en
+        segundo plano. Pueden estar en curso a la vez tantas peticiones como claves (multiplicado
+        por el número máximo de peticiones por clave)
+        :return: Devuelve un objeto de la clase concurrent.futures.Future con el resultado de la
+        petición.
+        '''
+        with self.lock:
+            if self.executor is None:
+                num_workers = max(len(self.apis) * self.scheduler.max_requests_per_key, 1)
+                self.executor = ThreadPoolExecutor(max_workers = num_workers)
+        return self.executor.submit(self.execute, f, *args, **kwargs)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
 
-from model.twitter_api_pool import TwitterAPIPool
-from tweepy import Cursor
+from model.twitter_api_pool import TwitterAPIPool, endpoint
+from datetime import timedelta
+from concurrent.futures import Future
+from threading import Lock
+
+from model.metrics import get_metrics
 
 class Twitter:
     '''
@@ -9,8 +13,26 @@ class Twitter:
     '''
 
     class _Twitter:
+        # Número máximo de tweets/usuarios que pueden consultarse en una sola petición a los
+        # endpoints statuses/lookup y users/lookup
+        lookup_batch_size = 100
+        # Número de tweets a consultar en cada request al endpoint search/tweets
+        search_page_size = 100
+
         def __init__(self):
-            self.api = TwitterAPIPool()
+            # El pool de claves de la API se crea la primera vez que se usa (ver la propiedad api)
+            self._api = None
+            self._api_lock = Lock()
+            # Caché de perfiles de usuarios
+            self.users = UserCache()
+
+        @property
+        def api(self):
+            if self._api is None:
+                with self._api_lock:
+                    if self._api is None:
+                        self._api = TwitterAPIPool()
+            return self._api
 
         def _process_tweet(self, status):
             '''
@@ -19,6 +41,8 @@ class Twitter:
             :return: Devuelve el tweet procesado, una instancia de la clase Tweet, o None si hubo
             un error al procesar la información del tweet.
             '''
+            if status is None:
+                return None
             try:
                 # ID del tweet.
                 id = status.id_str
@@ -34,9 +58,9 @@ class Twitter:
                 # Timestamp UNIX
                 timestamp = status.created_at.strftime('%s')
                 # ID del tweet retweeteado.
-                retweet_id = status.retweeted_status if is_retweet else None
+                retweet_id = status.retweeted_status.id_str if is_retweet else None
                 # ID del tweet respondido.
-                reply_id = status.in_reply_to_status_id if is_reply else None
+                reply_id = str(status.in_reply_to_status_id) if is_reply else None
 
                 # Info del usuario.
                 user_status = status.user
@@ -48,7 +72,7 @@ class Twitter:
 
                 return tweet
             except:
-                pass
+                get_metrics().increment('twitter_parse_failures_total', kind = 'tweet')
             return None
 
         def _process_user(self, user_status):
@@ -57,7 +81,11 @@ class Twitter:
             :param user_status: Es una instancia de la clase tweepy.User cuyos datos se procesarán.
             :return: Devuelve una instancia de la clase TweetUser con información sobre el perfil
             del usuario, o None si hubo un error al procesar la información.
+            Los usuarios se guardan en la caché de usuarios: si el usuario ya se había procesado
+            antes, se actualiza y se devuelve la instancia existente.
             '''
+            if user_status is None:
+                return None
             try:
                 # Nombre del usuario
                 screen_name = user_status.screen_name
@@ -67,11 +95,30 @@ class Twitter:
                 num_friends = user_status.friends_count
 
                 user = TwitterUser(screen_name, num_followers, num_friends)
-                return user
+                return self.users.intern(user, getattr(user_status, 'id_str', None))
             except:
-                pass
+                get_metrics().increment('twitter_parse_failures_total', kind = 'user')
             return None
 
+        def _completed_future(self, result):
+            future = Future()
+            future.set_result(result)
+            return future
+
+        def _none_if_missing(self, f, *args, **kwargs):
+            '''
+            Invoca la función indicada (una petición a la API de twitter). Si la API indica que el
+            objeto consultado no existe o no es accesible (ver TwitterAPIPool.is_permanent_error),
+            devuelve None en lugar de generar la excepción.
+            '''
+            from tweepy import TweepError
+            try:
+                return f(*args, **kwargs)
+            except TweepError as e:
+                if self.api.is_permanent_error(e):
+                    return None
+                raise
+
         def _search_tweet_by_id(self, id):
             '''
             Busca un tweet por ID
@@ -79,59 +126,176 @@ class Twitter:
             :return: Devuelve el tweet cuya ID es la indicada, o None si no hay ningún tweet
             con esa ID.
             '''
-            status = self.api.execute('get_status', id)
+            status = self._none_if_missing(self.api.execute, 'get_status', id)
             return self._process_tweet(status)
 
+        def _search_tweet_by_id_async(self, id):
+            '''
+            Es igual que el método anterior, solo que no es bloqueante.
+            :return: Devuelve un objeto de la clase concurrent.futures.Future cuyo resultado es
+            el tweet (o None si no hay ningún tweet con esa ID)
+            '''
+            @endpoint('get_status')
+            def request(api):
+                return self._process_tweet(self._none_if_missing(api.get_status, id))
+            return self.api.submit(request)
 
-        def _search_by_terms(self, terms, count):
+        def _lookup(self, endpoint_name, f, keys):
             '''
-            Busca tweets en los que se menciona alguno de los términos que se indican como parámetro.
-            :param term: String con los términos a buscar
-            :param count: Parámetro opcional que limita el número de tweets a devolver.
-            :return Devuelve una lista de tweets que encajan con alguno de los términos indicados
-            de tamaño "count", o una lista vacía en caso contrario.
-            '''
-
-            # Dividimos la búsqueda en distintos frames, indicando el parámetro since_id en cada
-            # frame
-            def search(count, since_id = None):
-                def request(api):
-                    # Invocamos a la API de tweepy, el método "search", usando el objeto API
-                    # proporcionado por twitter_api_pool
-                    statuses = list(Cursor(api.search, q = terms, since_id = since_id).items(count))
-                    return statuses
-                # Ejecutamos la request.
-                statuses = self.api.execute(request)
+            Realiza una búsqueda por lotes. Las claves a buscar se dividen en bloques de tamaño
+            lookup_batch_size, y cada bloque se consulta en paralelo (repartiendo los bloques entre
+            las claves de la API).
+            :param endpoint_name: Es el nombre del endpoint consultado.
+            :param f: Es un callback que recibe un objeto API y un bloque de claves, y devuelve
+            un listado de tuplas (clave, objeto encontrado)
+            :param keys: Es el listado de claves a buscar.
+            :return: Devuelve un diccionario clave -> objeto con los objetos encontrados.
+            '''
+            unique_keys = list(dict.fromkeys(keys))
+            chunks = [unique_keys[i:i+self.lookup_batch_size]
+                      for i in range(0, len(unique_keys), self.lookup_batch_size)]
 
-                # Procesamos los tweets, descartamos tweets no válidos.
-                tweets = []
-                for status in statuses:
-                    tweet = self._process_tweet(status)
-                    if not tweet is None:
-                        tweets.append(tweet)
+            @endpoint(endpoint_name)
+            def request(api, chunk):
+                return f(api, chunk)
+
+            futures = [self.api.submit(request, chunk) for chunk in chunks]
+            results = {}
+            for future in futures:
+                for key, item in future.result():
+                    if not item is None:
+                        results[key] = item
+            return results
+
+        def _search_tweets_by_ids(self, ids):
+            '''
+            Busca varios tweets por ID (usando el endpoint statuses/lookup)
+            :param ids: Es un listado de IDs de tweets
+            :return: Devuelve una lista con los tweets encontrados, en el mismo orden que las IDs
+            indicadas. Si no existe ningún tweet con alguna de las IDs, su posición contendrá None.
+            '''
+            ids = [str(id) for id in ids]
+
+            def request(api, chunk):
+                statuses = api.statuses_lookup(chunk)
+                return [(status.id_str, self._process_tweet(status)) for status in statuses]
 
-                if since_id is None:
-                    since_id = min([int(tweet.get_id()) for tweet in tweets]) - 1
+            tweets = self._lookup('statuses_lookup', request, ids)
+            return [tweets.get(id) for id in ids]
 
-                return tweets, since_id
+        def _lookup_users(self, api, **kwargs):
+            # Si no se encuentra ninguno de los usuarios, la API devuelve un error (código 17)
+            from tweepy import TweepError
+            try:
+                return api.lookup_users(**kwargs)
+            except TweepError as e:
+                if getattr(e, 'api_code', None) == 17:
+                    return []
+                raise
+
+        def _search_users_by_ids(self, ids):
+            '''
+            Busca varios perfiles de usuario por ID (usando el endpoint users/lookup)
+            :param ids: Es un listado de IDs de usuarios.
+            :return: Devuelve una lista con los usuarios encontrados, en el mismo orden que las
+            IDs indicadas. Si no hay ningún usuario con alguna de las IDs, su posición contendrá
+            None.
+            '''
+            ids = [str(id) for id in ids]
+            users = {id: self.users.get_by_id(id) for id in set(ids)}
 
-            # Número de tweets a consultar en cada request
-            step_count = 100
+            def request(api, chunk):
+                user_statuses = self._lookup_users(api, user_ids = chunk)
+                return [(user_status.id_str, self._process_user(user_status)) for user_status in user_statuses]
 
-            tweets, since_id = search(min(step_count, count))
+            users.update(self._lookup('lookup_users', request, [id for id in ids if users[id] is None]))
+            return [users.get(id) for id in ids]
 
-            if count < step_count:
-                return tweets
-            count -= step_count
-            since_id -= step_count
+        def _search_users_by_names(self, names):
+            '''
+            Igual que el método anterior, solo que la búsqueda se realiza por nombre (ScreenName)
+            :param names: Es un listado de nombres de usuarios.
+            :return: Devuelve una lista con los usuarios encontrados, en el mismo orden que los
+            nombres indicados (None para los nombres que no existen)
+            '''
+            # Los nombres de usuario de twitter no distinguen mayúsculas de minúsculas.
+            names = [name.lower() for name in names]
+            users = {name: self.users.get_by_name(name) for name in set(names)}
 
-            while count > 0: # Necesitamos "count" tweets
-                _tweets, since_id = search(min(step_count, count), since_id)
-                tweets.extend(_tweets)
-                since_id -= step_count
-                count -= step_count
+            def request(api, chunk):
+                user_statuses = self._lookup_users(api, screen_names = chunk)
+                return [(user_status.screen_name.lower(), self._process_user(user_status)) for user_status in user_statuses]
 
-            return tweets
+            users.update(self._lookup('lookup_users', request, [name for name in names if users[name] is None]))
+            return [users.get(name) for name in names]
+
+
+        def _iter_search_by_terms(self, terms, count = None, publish_start_date = None, publish_end_date = None,
+                                  since_id = None):
+            '''
+            Busca tweets en los que se menciona alguno de los términos que se indican como parámetro.
+            Los tweets se consultan página a página (del más reciente al más antiguo), a medida que
+            se van necesitando.
+            :param terms: String con los términos a buscar
+            :param count: Parámetro opcional que limita el número de tweets a devolver. Si es None,
+            se devolverán todos los tweets disponibles.
+            :param publish_start_date: Si se especifica (una instancia de la clase datetime), solo
+            se devolverán tweets publicados a partir de esta fecha.
+            :param publish_end_date: Si se especifica, solo se devolverán tweets publicados antes
+            de esta fecha.
+            :param since_id: Si se especifica, solo se devolverán tweets cuya ID es mayor que esta.
+            :return: Devuelve un generador que proporciona los tweets encontrados.
+            '''
+            start_timestamp = int(publish_start_date.strftime('%s')) if not publish_start_date is None else None
+            end_timestamp = int(publish_end_date.strftime('%s')) if not publish_end_date is None else None
+
+            @endpoint('search')
+            def request(api, page_size, **kwargs):
+                # Invocamos a la API de tweepy, el método "search", usando el objeto API
+                # proporcionado por twitter_api_pool
+                return api.search(q = terms, count = page_size, **kwargs)
+
+            params = {}
+            if not since_id is None:
+                params['since_id'] = since_id
+            if not publish_end_date is None:
+                # La API solo permite indicar el día (los tweets se filtran después por su timestamp)
+                params['until'] = (publish_end_date + timedelta(days = 1)).strftime('%Y-%m-%d')
+
+            num_tweets = 0
+            while count is None or num_tweets < count:
+                # Ejecutamos la request (solo pedimos los tweets que faltan)
+                page_size = min(self.search_page_size, count - num_tweets) if not count is None else self.search_page_size
+                statuses = self.api.execute(request, page_size, **params)
+                if len(statuses) == 0:
+                    return
+
+                # La siguiente página contendrá los tweets anteriores al más antiguo de esta página.
+                params['max_id'] = min([status.id for status in statuses]) - 1
+
+                # Procesamos los tweets, descartamos tweets no válidos.
+                for status in statuses:
+                    tweet = self._process_tweet(status)
+                    if tweet is None:
+                        continue
+                    timestamp = int(tweet.get_timestamp())
+                    if not end_timestamp is None and timestamp >= end_timestamp:
+                        continue
+                    if not start_timestamp is None and timestamp < start_timestamp:
+                        # El resto de tweets son anteriores
+                        return
+                    yield tweet
+                    num_tweets += 1
+                    if not count is None and num_tweets >= count:
+                        return
+
+
+        def _search_by_terms(self, terms, count, publish_start_date = None, publish_end_date = None):
+            '''
+            Es igual que el método anterior, solo que devuelve una lista con los tweets encontrados
+            (de tamaño "count" como máximo)
+            '''
+            return list(self._iter_search_by_terms(terms, count, publish_start_date, publish_end_date))
 
 
         def _search_user_by_id(self, id):
@@ -141,9 +305,27 @@ class Twitter:
             :return: Devuelve un objeto de la clase TweetUser con la info del usuario, o None
             si no hay ningún usuario con la ID indicada.
             '''
-            user_status = self.api.execute('get_user', user_id = id)
+            user = self.users.get_by_id(id)
+            if not user is None:
+                return user
+            user_status = self._none_if_missing(self.api.execute, 'get_user', user_id = id)
             return self._process_user(user_status)
 
+        def _search_user_by_id_async(self, id):
+            '''
+            Es igual que el método anterior, solo que no es bloqueante.
+            :return: Devuelve un objeto de la clase concurrent.futures.Future cuyo resultado es
+            el usuario (o None si no hay ningún usuario con esa ID)
+            '''
+            user = self.users.get_by_id(id)
+            if not user is None:
+                return self._completed_future(user)
+
+            @endpoint('get_user')
+            def request(api):
+                return self._process_user(self._none_if_missing(api.get_user, user_id = id))
+            return self.api.submit(request)
+
         def _search_user_by_name(self, name):
             '''
             Igual que el método anterior, solo que la búsqueda se realiza por nombre (ScreenName)
@@ -151,18 +333,39 @@ class Twitter:
             :param name:
             :return:
             '''
-            user_status = self.api.execute('get_user', screen_name = name)
+            user = self.users.get_by_name(name)
+            if not user is None:
+                return user
+            user_status = self._none_if_missing(self.api.execute, 'get_user', screen_name = name)
             return self._process_user(user_status)
 
+        def _search_user_by_name_async(self, name):
+            '''
+            Es igual que el método anterior, solo que no es bloqueante.
+            :return: Devuelve un objeto de la clase concurrent.futures.Future cuyo resultado es
+            el usuario (o None si no hay ningún usuario con ese nombre)
+            '''
+            user = self.users.get_by_name(name)
+            if not user is None:
+                return self._completed_future(user)
+
+            @endpoint('get_user')
+            def request(api):
+                return self._process_user(self._none_if_missing(api.get_user, screen_name = name))
+            return self.api.submit(request)
+
 
     instance = None
+    instance_lock = Lock()
 
     def __init__(self):
-        if Twitter.instance is None:
-            Twitter.instance = self._Twitter()
+        with Twitter.instance_lock:
+            if Twitter.instance is None:
+                Twitter.instance = self._Twitter()
 
     def __getattr__(self, item):
         return getattr(Twitter.instance, item)
 
 from model.tweet import Tweet
-from model.user import TwitterUser
\ No newline at end of file
+from model.user import TwitterUser
+from model.user_cache import UserCache
\ No newline at end of file
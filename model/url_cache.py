@@ -0,0 +1,156 @@
+'''
+Este script define una caché para las urls resueltas (url original -> dirección final).
+La caché tiene dos niveles: uno en memoria (LRU) y otro en disco (SQLite) que se mantiene
+entre distintas ejecuciones.
+'''
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class URLCache:
+    '''
+    Caché de urls resueltas. Cada entrada caduca pasado un tiempo (TTL). También se guardan
+    las urls que no pudieron resolverse (caché negativa), con un TTL distinto.
+    '''
+
+    # Fichero por defecto donde se guarda la caché en disco.
+    url_cache_file = '../data/url_cache.db'
+    # Cada cuánto tiempo (en segundos) se eliminan del disco las entradas caducadas.
+    purge_interval = 3600
+
+    def __init__(self, path = None, max_size = 100000, ttl = 7 * 24 * 3600, negative_ttl = 3600):
+        '''
+        Inicializa la instancia.
+        :param path: Es la ruta del fichero SQLite donde se guardará la caché. Si es None, la
+        caché solo se mantendrá en memoria.
+        :param max_size: Número máximo de entradas en memoria. Cuando se supera, se descartan
+        las entradas usadas hace más tiempo.
+        :param ttl: Tiempo de vida (en segundos) de las urls resueltas correctamente.
+        :param negative_ttl: Tiempo de vida (en segundos) de las urls que no pudieron resolverse.
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+        self.db = None
+        if not path is None:
+            import sqlite3
+            self.db = sqlite3.connect(path, check_same_thread = False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS urls ' +
+                            '(url TEXT PRIMARY KEY, final_url TEXT, expires_at REAL)')
+            self.db.commit()
+        self.last_purge_time = None
+        self.purge_expired()
+
+        # Estadísticas
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def _set_memory_entry(self, url, final_url, expires_at):
+        self.entries[url] = (final_url, expires_at)
+        self.entries.move_to_end(url)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+
+    def get(self, url):
+        '''
+        Busca una url en la caché.
+        :return: Devuelve una tupla (encontrada, dirección final). Si la url se encuentra en la
+        caché pero no pudo resolverse, devuelve (True, None). Si la url no está en la caché (o
+        su entrada ha caducado), devuelve (False, None)
+        '''
+        now = time()
+        with self.lock:
+            entry = self.entries.get(url)
+            if not entry is None and entry[1] > now:
+                self.entries.move_to_end(url)
+                self.memory_hits += 1
+                return True, entry[0]
+
+            if not self.db is None:
+                row = self.db.execute('SELECT final_url, expires_at FROM urls WHERE url = ?', (url,)).fetchone()
+                if not row is None and row[1] > now:
+                    self._set_memory_entry(url, row[0], row[1])
+                    self.disk_hits += 1
+                    return True, row[0]
+
+            self.misses += 1
+            return False, None
+
+
+    def put_many(self, items):
+        '''
+        Añade varias urls a la caché.
+        :param items: Es un listado de tuplas (url, dirección final). La dirección final puede
+        ser None para indicar que la url no pudo resolverse.
+        '''
+        now = time()
+        rows = []
+        with self.lock:
+            for url, final_url in items:
+                expires_at = now + (self.ttl if not final_url is None else self.negative_ttl)
+                self._set_memory_entry(url, final_url, expires_at)
+                rows.append((url, final_url, expires_at))
+            if not self.db is None and len(rows) > 0:
+                self.db.executemany('INSERT OR REPLACE INTO urls VALUES (?, ?, ?)', rows)
+                self.db.commit()
+        if now - self.last_purge_time >= self.purge_interval:
+            self.purge_expired()
+
+
+    def purge_expired(self):
+        '''
+        Elimina las entradas caducadas (en memoria y en disco). Se invoca al abrir la caché y,
+        después, periódicamente al añadir urls (cada purge_interval segundos)
+        :return: Devuelve el número de entradas eliminadas del disco.
+        '''
+        now = time()
+        with self.lock:
+            self.last_purge_time = now
+            for url in [url for url, (final_url, expires_at) in self.entries.items() if expires_at <= now]:
+                del self.entries[url]
+            if self.db is None:
+                return 0
+            num_rows = self.db.execute('DELETE FROM urls WHERE expires_at <= ?', (now,)).rowcount
+            self.db.commit()
+            return num_rows
+
+
+    def put(self, url, final_url):
+        '''
+        Igual que el método anterior, pero añade una única url.
+        '''
+        self.put_many([(url, final_url)])
+
+
+    def get_stats(self):
+        '''
+        :return: Devuelve un diccionario con el número de aciertos (en memoria y en disco) y
+        fallos de la caché, y el ratio de aciertos.
+        '''
+        with self.lock:
+            num_lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.memory_hits + self.disk_hits) / num_lookups if num_lookups > 0 else 0.0,
+                'size': len(self.entries)
+            }
+
+
+    def close(self):
+        '''
+        Cierra el fichero de la caché en disco.
+        '''
+        with self.lock:
+            if not self.db is None:
+                self.db.close()
+                self.db = None
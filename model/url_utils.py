@@ -0,0 +1,180 @@
+'''
+Este script contiene utilidades para resolver las urls que aparecen en los tweets, es decir,
+seguir las redirecciones HTTP de los acortadores (t.co, bit.ly, ...) hasta obtener la
+dirección final.
+Las urls se resuelven en paralelo (con un número acotado de hilos) reutilizando las
+conexiones HTTP (keep-alive) mediante una sesión compartida. Antes de realizar ninguna petición
+se consulta la caché de urls resueltas (ver model.url_cache)
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time
+from os.path import dirname, isdir
+
+from model.metrics import get_metrics
+from model.url_cache import URLCache
+
+
+class LinkResolver:
+    '''
+    Esta clase permite resolver urls siguiendo sus redirecciones HTTP.
+    '''
+    def __init__(self, max_workers = 16, cache = None):
+        '''
+        Inicializa la instancia.
+        :param max_workers: Es el número máximo de urls que se resolverán a la vez (también es
+        el número máximo de conexiones abiertas por cada host)
+        :param cache: Es una instancia de la clase URLCache. Si se especifica, solo se realizarán
+        peticiones HTTP para las urls que no estén en la caché.
+        '''
+        # El módulo requests se importa cuando se necesita (tarda en importarse)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = max_workers, pool_maxsize = max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+
+        # Estadísticas
+        self.lock = Lock()
+        self.num_links = 0
+        self.num_cached_links = 0
+        self.num_failures = 0
+        self.elapsed_time = 0.0
+
+
+    def _follow_link(self, link, timeout):
+        '''
+        Sigue las redirecciones de la url indicada.
+        Primero se realiza una petición HEAD. Si el servidor no la admite, se realiza una
+        petición GET en modo streaming, que se cierra sin descargar el cuerpo de la respuesta en
+        cuanto se conoce la dirección final.
+        :return: Devuelve la dirección final. Genera una excepción si no se pudo obtener.
+        '''
+        with get_metrics().timer('link_resolve_seconds'):
+            response = self.session.head(link, allow_redirects = True, timeout = timeout)
+            response.close()
+            if response.status_code < 400:
+                return response.url
+
+            response = self.session.get(link, allow_redirects = True, timeout = timeout, stream = True)
+            response.close()
+            return response.url
+
+
+    def _is_dead_link(self, error):
+        '''
+        :return: Devuelve True si el error obtenido al resolver una url indica que la url no es
+        válida (demasiadas redirecciones, url mal formada, ...) o que su dominio no existe o no
+        responde (errores de conexión), de modo que puede guardarse en la caché negativa. Los
+        timeouts no se guardan (el servidor puede estar temporalmente sobrecargado); los errores
+        de conexión temporales solo se guardan durante el TTL negativo de la caché (ver URLCache)
+        '''
+        import requests
+        if isinstance(error, requests.Timeout):
+            return False
+        return isinstance(error, (requests.ConnectionError, requests.TooManyRedirects, requests.exceptions.InvalidURL,
+                                  requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema))
+
+
+    def resolve_many(self, links, timeout = 10):
+        '''
+        Resuelve varias urls a la vez.
+        :param links: Es un listado de urls.
+        :param timeout: Tiempo máximo de espera (en segundos) de cada petición HTTP.
+        :return: Devuelve una lista con la dirección final de cada url (en el mismo orden que
+        en la lista de entrada). Si una url no pudo resolverse, su posición contendrá None.
+        '''
+        start_time = time()
+
+        # Las urls repetidas solo se resuelven una vez.
+        unique_links = list(set(links))
+        resolved = {}
+
+        # Primero consultamos la caché
+        if not self.cache is None:
+            pending_links = []
+            for link in unique_links:
+                found, final_url = self.cache.get(link)
+                if found:
+                    resolved[link] = final_url
+                else:
+                    pending_links.append(link)
+        else:
+            pending_links = unique_links
+
+        futures = [self.executor.submit(self._follow_link, link, timeout) for link in pending_links]
+        num_failures = 0
+        cached_links = []
+        for link, future in zip(pending_links, futures):
+            try:
+                resolved[link] = future.result()
+                cached_links.append(link)
+            except Exception as e:
+                resolved[link] = None
+                num_failures += 1
+                if self._is_dead_link(e):
+                    cached_links.append(link)
+
+        # Guardamos en la caché las urls resueltas, y las que no son válidas (pero no las que
+        # fallaron por errores de red, que pueden ser temporales)
+        if not self.cache is None:
+            self.cache.put_many([(link, resolved[link]) for link in cached_links])
+
+        metrics = get_metrics()
+        metrics.increment('link_resolve_total', len(pending_links))
+        metrics.increment('link_resolve_cached_total', len(unique_links) - len(pending_links))
+        metrics.increment('link_resolve_failures_total', num_failures)
+
+        with self.lock:
+            self.num_links += len(pending_links)
+            self.num_cached_links += len(unique_links) - len(pending_links)
+            self.num_failures += num_failures
+            self.elapsed_time += time() - start_time
+
+        return [resolved[link] for link in links]
+
+
+    def resolve(self, link, timeout = 10):
+        '''
+        Igual que el método anterior, pero resuelve una única url.
+        :return: Devuelve la dirección final de la url, o None si no pudo resolverse.
+        '''
+        return self.resolve_many([link], timeout)[0]
+
+
+    def get_stats(self):
+        '''
+        :return: Devuelve un diccionario con estadísticas sobre las urls resueltas hasta el
+        momento: número de urls resueltas mediante peticiones HTTP, número de urls obtenidas de
+        la caché, número de fallos, tiempo empleado (en segundos) y throughput (urls por segundo)
+        '''
+        with self.lock:
+            return {
+                'num_links': self.num_links,
+                'num_cached_links': self.num_cached_links,
+                'num_failures': self.num_failures,
+                'elapsed_time': self.elapsed_time,
+                'links_per_second': self.num_links / self.elapsed_time if self.elapsed_time > 0 else 0.0
+            }
+
+
+# Instancia compartida por defecto (se crea la primera vez que se usa)
+_default_resolver = None
+
+def get_link_resolver():
+    '''
+    :return: Devuelve la instancia de LinkResolver compartida por defecto. Usa una caché
+    persistente en el fichero URLCache.url_cache_file (o solo en memoria si el directorio de
+    dicho fichero no existe)
+    '''
+    global _default_resolver
+    if _default_resolver is None:
+        path = URLCache.url_cache_file
+        cache = URLCache(path if isdir(dirname(path) or '.') else None)
+        _default_resolver = LinkResolver(cache = cache)
+    return _default_resolver
@@ -7,6 +7,9 @@ class TwitterUser(dict):
     Esta clase representa a un usuario. Provee información relativa a su
     perfil.
     '''
+    # Evita crear un __dict__ en cada instancia
+    __slots__ = ()
+
     def __init__(self, screen_name, num_followers, num_friends):
         super().__init__()
         self['name'] = screen_name
@@ -32,6 +35,25 @@ class TwitterUser(dict):
         '''
         return Twitter()._search_user_by_id(id)
 
+    @staticmethod
+    def search_by_id_async(id):
+        '''
+        Es igual que el método anterior, solo que no es bloqueante.
+        :return: Devuelve un objeto de la clase concurrent.futures.Future cuyo resultado es el
+        usuario, o None si no hay nadie que tenga esa ID.
+        '''
+        return Twitter()._search_user_by_id_async(id)
+
+    @staticmethod
+    def search_by_ids(ids):
+        '''
+        Busca varios usuarios por ID. Se consultan hasta 100 usuarios en cada petición a la API.
+        :param ids: Es un listado de IDs de usuarios.
+        :return: Devuelve una lista con los usuarios cuyas IDs son las indicadas (en el mismo
+        orden). Las posiciones de las IDs que no pertenecen a nadie contendrán None.
+        '''
+        return Twitter()._search_users_by_ids(ids)
+
     @staticmethod
     def search_by_name(name):
         '''
@@ -42,12 +64,31 @@ class TwitterUser(dict):
         '''
         return Twitter()._search_user_by_name(name)
 
+    @staticmethod
+    def search_by_name_async(name):
+        '''
+        Es igual que el método anterior, solo que no es bloqueante.
+        :return: Devuelve un objeto de la clase concurrent.futures.Future cuyo resultado es el
+        usuario, o None si no hay nadie con ese nombre.
+        '''
+        return Twitter()._search_user_by_name_async(name)
+
+    @staticmethod
+    def search_by_names(names):
+        '''
+        Es igual que el método anterior, solo que la búsqueda se realiza por nombre (Screen Name)
+        :param names: Es un listado de nombres de usuarios.
+        :return: Devuelve una lista con los usuarios cuyos nombres son los indicados (en el mismo
+        orden). Las posiciones de los nombres que no pertenecen a nadie contendrán None.
+        '''
+        return Twitter()._search_users_by_names(names)
+
 
     def __str__(self):
         return self.get_name()
 
     def __hash__(self):
-        return hash(self.__repr__())
+        return hash(self.get_name())
 
     def __eq__(self, other):
         return isinstance(other, TwitterUser) and self.get_name() == other.get_name()
@@ -0,0 +1,117 @@
+'''
+Este script define una caché de perfiles de usuarios de twitter, indexada por ID y por nombre
+(Screen Name).
+'''
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class UserCache:
+    '''
+    Caché de perfiles de usuarios.
+    Cada usuario se guarda una sola vez en memoria: cuando se procesa de nuevo un usuario que ya
+    está en la caché, se actualiza el objeto existente (número de seguidores y amigos) y se
+    devuelve este, en lugar de crear uno nuevo.
+    Las entradas se consideran obsoletas pasado un tiempo (TTL), ya que el número de seguidores
+    cambia con el tiempo. Cuando se supera el tamaño máximo, se descartan los usuarios usados
+    hace más tiempo.
+    '''
+    def __init__(self, max_size = 100000, ttl = 3600):
+        '''
+        Inicializa la instancia.
+        :param max_size: Número máximo de usuarios en la caché.
+        :param ttl: Tiempo (en segundos) tras el cual el perfil de un usuario se considera obsoleto.
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = Lock()
+        # Diccionario nombre -> [usuario, instante de actualización, ID]
+        self.entries = OrderedDict()
+        # Diccionario ID -> nombre
+        self.names_by_id = {}
+
+        # Estadísticas
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+
+    def intern(self, user, id = None):
+        '''
+        Añade un usuario a la caché.
+        :param user: Es el usuario (una instancia de la clase TwitterUser)
+        :param id: Es la ID del usuario (opcional)
+        :return: Si el usuario ya estaba en la caché, actualiza su número de seguidores y amigos y
+        devuelve el objeto que ya estaba en la caché. En caso contrario, devuelve el usuario
+        indicado.
+        '''
+        name = user.get_name().lower()
+        id = str(id) if not id is None else None
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = [user, time(), id]
+                self.entries[name] = entry
+                if len(self.entries) > self.max_size:
+                    old_name, old_entry = self.entries.popitem(last = False)
+                    # Si el usuario ha cambiado de nombre, su ID apunta ya al nombre nuevo.
+                    if self.names_by_id.get(old_entry[2]) == old_name:
+                        del self.names_by_id[old_entry[2]]
+            else:
+                entry[0].update(user)
+                entry[1] = time()
+                if entry[2] is None:
+                    entry[2] = id
+                self.entries.move_to_end(name)
+            if not id is None:
+                self.names_by_id[id] = name
+            return entry[0]
+
+
+    def get_by_name(self, name):
+        '''
+        :return: Devuelve el usuario cuyo nombre es el indicado, o None si no está en la caché o
+        su perfil está obsoleto.
+        '''
+        name = name.lower()
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time() - entry[1] > self.ttl:
+                self.stale += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+            return entry[0]
+
+
+    def get_by_id(self, id):
+        '''
+        Igual que el método anterior, solo que busca el usuario por ID.
+        '''
+        with self.lock:
+            name = self.names_by_id.get(str(id))
+            if name is None:
+                self.misses += 1
+                return None
+        return self.get_by_name(name)
+
+
+    def get_stats(self):
+        '''
+        :return: Devuelve un diccionario con el número de aciertos, fallos y entradas obsoletas
+        encontradas, el ratio de aciertos y el número de usuarios en la caché.
+        '''
+        with self.lock:
+            num_lookups = self.hits + self.misses + self.stale
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_ratio': self.hits / num_lookups if num_lookups > 0 else 0.0,
+                'size': len(self.entries)
+            }